@@ -14,19 +14,51 @@ Script complet pour la gestion de l'agenda Sigma :
 
 # CHARGEMENT DES BIBLIOTHEQUES
 # ============================
+import argparse
+import base64
+import bisect
 import csv
+import ctypes
+import ctypes.util
+import gzip
+import heapq
+import hashlib
+import json
 import os
+import random
+import queue
+import shutil
+import sqlite3
+import select
+import struct
+import sys
 import time
 import re
 import threading
-from io import BytesIO
-from datetime import timedelta, datetime as dt, datetime
+import weakref
+import fnmatch
+import itertools
+import posixpath
+import zipfile
+from io import StringIO
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import timedelta, timezone, datetime as dt, datetime
+from types import MappingProxyType
+from zoneinfo import ZoneInfo
+import numpy as np
 import pandas as pd
-import openpyxl
 from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string, coordinate_to_tuple, range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+import httplib2
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -64,11 +96,20 @@ for key, value in config.items():
     print(f"{key} = {value}")
 
 FILE_PATH = config.get("excel_file_path")          # Fichier Excel d'origine
-SHEET_NAME = config.get("sheet_name", "M1 2324")      # Nom de la feuille à traiter
+SHEET_NAME = config.get("sheet_name", "M1 2324")      # Feuille(s) à traiter : noms ou motifs séparés par des virgules
 CSV_MODIFICATIONS = config.get("modifications_csv", os.path.join(os.path.dirname(FILE_PATH), "journal_modifications.csv"))
 OUTPUT_CSV = config.get("output_csv", os.path.join(os.path.dirname(FILE_PATH), "output.csv"))
+OUTPUT_ICS = config.get("output_ics", os.path.join(os.path.dirname(FILE_PATH), "output.ics"))
+if OUTPUT_ICS.lower() in ("", "aucun", "non"):
+    OUTPUT_ICS = None
+JOURNAL_SQLITE = config.get("journal_sqlite", os.path.join(os.path.dirname(FILE_PATH), "journal_modifications.sqlite"))
+if JOURNAL_SQLITE.lower() in ("", "aucun", "non"):
+    JOURNAL_SQLITE = None
+ETAT_AGENDA = config.get("etat_agenda", os.path.join(os.path.dirname(FILE_PATH), "etat_agenda.sqlite"))
 TOKEN_PATH = config.get("token_path", "token.json")
 CREDENTIALS_PATH = config.get("credentials_path", "credentials.json")
+BACKEND_EXTRACTION = config.get("backend_extraction", "openpyxl").lower()  # Moteur de lecture : openpyxl ou xml
+NB_PROCESSUS = int(config.get("nb_processus", os.cpu_count() or 1))  # Processus pour la lecture de plusieurs feuilles
 
 # =============================================================================
 # PARTIE 2 : SURVEILLANCE DES MODIFICATIONS EXCEL
@@ -80,6 +121,14 @@ MAX_ROW = 34   # Dernière ligne de données
 MIN_COL = 5    # Colonne E
 MAX_COL = 15   # Colonne O
 INTERVALLE_MODIF = 30  # Intervalle de vérification en secondes
+MODE_SURVEILLANCE = config.get("mode_surveillance", "auto").lower()  # auto, inotify ou polling
+DELAI_STABILISATION = float(config.get("delai_stabilisation", 2))  # Secondes sans écriture avant rechargement
+INTERVALLE_RECONCILIATION = int(config.get("intervalle_reconciliation", 3600))  # Synchronisation complète (s)
+CAPACITE_HISTORIQUE = int(config.get("capacite_historique", 10000))  # Modifications mémorisées pour le dédoublonnage
+JOURNAL_FSYNC = config.get("journal_fsync", "lot").lower()  # jamais, lot ou toujours
+JOURNAL_TAILLE_MAX_MO = float(config.get("journal_taille_max_mo", 0))  # Taille déclenchant l'archivage (0 : aucune)
+JOURNAL_ROTATION = config.get("journal_rotation", "aucune").lower()  # aucune, jour ou mois
+JOURNAL_COMPRESSION = config.get("journal_compression", "non").lower() in ("oui", "true", "1")  # Archives en .gz
 
 # Correspondance des couleurs aux lieux pour la surveillance
 COLOR_TO_LOCATION = {
@@ -93,38 +142,390 @@ COLOR_TO_LOCATION = {
     "F5BCE9": "UT2JGS025",
 }
 
-def charger_etat_excel():
+# -----------------------------------------------------------------------------
+# Détection des changements à partir du répertoire central du zip (.xlsx)
+# -----------------------------------------------------------------------------
+
+_cache_signature = {"stat": None, "motifs": None, "signature": None,
+                    "cle_classeur": None, "feuilles": {}, "commentaires": {}}
+_verrou_signature = threading.Lock()
+
+def signature_classeur(motifs=None):
     """
-    Charge l'état actuel des cellules du fichier Excel en tenant compte
-    des cellules fusionnées sur la feuille spécifiée.
-    Retourne un dictionnaire indexé par (feuille, coordonnée).
+    Retourne une signature des parties du classeur utiles à l'extraction : pour chaque feuille
+    surveillée, le CRC32 de son XML et de ses commentaires, plus ceux de la table des styles et
+    des chaînes partagées. Les CRC sont lus dans le répertoire central du zip, sans décompresser
+    les feuilles ; workbook.xml et les fichiers de relations ne sont relus que si leur CRC change.
+    Deux signatures égales signifient que la zone extraite n'a pas pu changer.
+    Retourne None si le classeur est illisible (enregistrement en cours par exemple).
     """
-    wb = load_workbook(FILE_PATH, data_only=True)
-    ws = wb[SHEET_NAME]
-    etat = {}
-    merged_ranges = {}
-    for merged_range in ws.merged_cells.ranges:
-        min_col, min_row, max_col, max_row = merged_range.bounds
-        coord_fusion = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
-        for row in range(min_row, max_row + 1):
-            for col in range(min_col, max_col + 1):
-                merged_ranges[f"{get_column_letter(col)}{row}"] = coord_fusion
-    for row in ws.iter_rows(min_row=MIN_ROW, max_row=MAX_ROW, min_col=MIN_COL, max_col=MAX_COL):
-        for cell in row:
-            coord = merged_ranges.get(cell.coordinate, cell.coordinate)
-            couleur_hex = ""
-            if cell.fill and cell.fill.start_color and cell.fill.start_color.rgb:
-                couleur_hex = cell.fill.start_color.rgb[-6:]
-            lieu = COLOR_TO_LOCATION.get(couleur_hex, "")
-            valeur = cell.value
-            commentaire = cell.comment.text if cell.comment else ""
-            etat[(SHEET_NAME, coord)] = {
-                "valeur": valeur,
-                "lieu": lieu,
-                "commentaire": commentaire
-            }
-    wb.close()
-    return etat
+    motifs = motifs or SHEET_NAME
+    with _verrou_signature:
+        try:
+            stat = os.stat(FILE_PATH)
+            cle_stat = (stat.st_mtime_ns, stat.st_size)
+            if cle_stat == _cache_signature["stat"] and motifs == _cache_signature["motifs"]:
+                return _cache_signature["signature"]
+            with zipfile.ZipFile(FILE_PATH) as archive:
+                crc = {info.filename: info.CRC for info in archive.infolist()}
+                cle_classeur = (crc.get("xl/workbook.xml"), crc.get("xl/_rels/workbook.xml.rels"))
+                if cle_classeur != _cache_signature["cle_classeur"]:
+                    # Correspondance nom de feuille -> partie XML, relue seulement si workbook.xml a changé
+                    relations = _lire_relations(archive, "xl/_rels/workbook.xml.rels")
+                    classeur = ET.fromstring(archive.read("xl/workbook.xml"))
+                    _cache_signature["feuilles"] = {
+                        feuille.get("name"): relations.get(feuille.get(NS_REL + "id"), ("", ""))[1]
+                        for feuille in classeur.iter(NS_MAIN + "sheet")
+                    }
+                    _cache_signature["cle_classeur"] = cle_classeur
+                parties = []
+                for feuille in _filtrer_feuilles(motifs, list(_cache_signature["feuilles"]), silencieux=True):
+                    membre = _cache_signature["feuilles"].get(feuille)
+                    if membre is None:
+                        # Feuille absente du classeur : elle compte dans la signature sans la rendre illisible
+                        parties.append((feuille, None, None, ()))
+                        continue
+                    rels = posixpath.join(posixpath.dirname(membre), "_rels", posixpath.basename(membre) + ".rels")
+                    cache_rels = _cache_signature["commentaires"].get(rels)
+                    if cache_rels is None or cache_rels[0] != crc.get(rels):
+                        commentaires = [m for t, m in _lire_relations(archive, rels).values() if t.endswith("/comments")]
+                        _cache_signature["commentaires"][rels] = cache_rels = (crc.get(rels), commentaires)
+                    parties.append((feuille, membre, crc.get(membre),
+                                    tuple(crc.get(m) for m in cache_rels[1])))
+            signature = (tuple(parties), crc.get("xl/styles.xml"), crc.get("xl/sharedStrings.xml"))
+        except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError):
+            return None
+        _cache_signature.update(stat=cle_stat, motifs=motifs, signature=signature)
+        return signature
+
+# -----------------------------------------------------------------------------
+# Attente des modifications : inotify (Linux) avec repli sur l'interrogation périodique
+# -----------------------------------------------------------------------------
+
+# Constantes de l'API inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+
+class SurveillantInotify:
+    """
+    Surveille le dossier du classeur avec inotify. On surveille le dossier et non le fichier :
+    Excel et LibreOffice enregistrent dans un fichier temporaire puis le renomment à la place
+    de l'original, ce qui invaliderait une surveillance posée sur le fichier lui-même.
+    Seuls les événements portant sur le nom du classeur sont retenus (les fichiers temporaires
+    et les verrous "~$classeur.xlsx" / ".~lock.classeur.xlsx#" sont ignorés).
+    """
+
+    MASQUE = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    def __init__(self, chemin):
+        self.dossier = os.path.dirname(os.path.abspath(chemin))
+        self.nom_fichier = os.path.basename(chemin)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._ajouter_surveillance()
+
+    def _ajouter_surveillance(self):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.dossier), self.MASQUE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch({self.dossier})")
+
+    def _lire_evenements(self):
+        """Lit les événements en attente et retourne la liste des couples (masque, nom)."""
+        donnees = os.read(self.fd, 65536)
+        evenements = []
+        position = 0
+        while position + 16 <= len(donnees):
+            _, masque, _, longueur = struct.unpack_from("iIII", donnees, position)
+            nom = donnees[position + 16:position + 16 + longueur].rstrip(b"\0")
+            evenements.append((masque, os.fsdecode(nom)))
+            position += 16 + longueur
+        return evenements
+
+    def _est_pertinent(self, masque, nom):
+        if masque & IN_Q_OVERFLOW:
+            return True
+        if masque & IN_IGNORED:
+            # Le dossier a été déplacé ou supprimé : on tente de le surveiller à nouveau
+            self._ajouter_surveillance()
+            return True
+        return nom == self.nom_fichier
+
+    def _fichier_stable(self):
+        """Le classeur est présent et son archive zip est complète (enregistrement terminé)."""
+        return os.path.exists(os.path.join(self.dossier, self.nom_fichier)) and zipfile.is_zipfile(
+            os.path.join(self.dossier, self.nom_fichier))
+
+    def attendre(self, timeout):
+        """
+        Attend une modification du classeur pendant au plus timeout secondes.
+        Une rafale d'enregistrements est regroupée : on ne rend la main qu'après DELAI_STABILISATION
+        secondes sans nouvel événement et lorsque le fichier est de nouveau lisible.
+        Retourne True si le classeur a changé, False si le délai a expiré sans événement.
+        """
+        echeance = time.monotonic() + timeout
+        stabilisation = None
+        while True:
+            maintenant = time.monotonic()
+            limite = stabilisation if stabilisation is not None else echeance
+            if maintenant >= limite:
+                if stabilisation is None:
+                    return False
+                if self._fichier_stable():
+                    return True
+                stabilisation = maintenant + DELAI_STABILISATION
+                continue
+            prets, _, _ = select.select([self.fd], [], [], limite - maintenant)
+            if prets and any(self._est_pertinent(masque, nom) for masque, nom in self._lire_evenements()):
+                stabilisation = time.monotonic() + DELAI_STABILISATION
+
+    def fermer(self):
+        os.close(self.fd)
+
+def creer_surveillant():
+    """
+    Crée le surveillant inotify selon mode_surveillance (auto, inotify ou polling).
+    Retourne None lorsque l'interrogation périodique doit être utilisée
+    (mode polling, système autre que Linux ou inotify indisponible).
+    """
+    if MODE_SURVEILLANCE == "polling":
+        return None
+    try:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify n'est disponible que sous Linux")
+        return SurveillantInotify(FILE_PATH)
+    except (OSError, AttributeError) as e:
+        print(f"⚠️ inotify indisponible ({e}), surveillance par interrogation toutes les {INTERVALLE_MODIF} s.")
+        return None
+
+def attendre_modification(surveillant):
+    """
+    Attend la prochaine modification du classeur : événement inotify (avec une vérification
+    de secours toutes les INTERVALLE_MODIF secondes) ou simple attente en mode interrogation.
+    """
+    if surveillant is None:
+        time.sleep(INTERVALLE_MODIF)
+    else:
+        surveillant.attendre(INTERVALLE_MODIF)
+
+def index_fusions(grille):
+    """
+    Retourne l'index des plages fusionnées de la grille qui touchent la zone surveillée :
+    dictionnaire ligne -> (liste triée des colonnes de début, liste des plages correspondantes),
+    chaque plage étant le tuple d'entiers (min_row, min_col, max_row, max_col).
+    L'index est construit une seule fois par grille (donc par version du classeur) et conservé dans celle-ci.
+    """
+    if "index_fusions" not in grille:
+        # Grille non figée (lecture directe) : l'index est calculé puis conservé dans la grille
+        par_ligne = {}
+        for min_col, min_row, max_col, max_row in sorted(grille["fusions"]):
+            if max_row < MIN_ROW or min_row > MAX_ROW or max_col < MIN_COL or min_col > MAX_COL:
+                continue
+            for row in range(max(min_row, MIN_ROW), min(max_row, MAX_ROW) + 1):
+                debuts, plages = par_ligne.setdefault(row, ([], []))
+                debuts.append(min_col)
+                plages.append((min_row, min_col, max_row, max_col))
+        grille["index_fusions"] = par_ligne
+    return grille["index_fusions"]
+
+def plage_fusionnee(index, row, col):
+    """Retourne la plage fusionnée (min_row, min_col, max_row, max_col) contenant la cellule, ou None."""
+    ligne = index.get(row)
+    if ligne is None:
+        return None
+    debuts, plages = ligne
+    position = bisect.bisect_right(debuts, col) - 1
+    if position >= 0 and col <= plages[position][3]:
+        return plages[position]
+    return None
+
+def format_coordonnees(coord):
+    """Formate une coordonnée (min_row, min_col, max_row, max_col) en "E12" ou "E12:F12"."""
+    min_row, min_col, max_row, max_col = coord
+    debut = f"{get_column_letter(min_col)}{min_row}"
+    if (min_row, min_col) == (max_row, max_col):
+        return debut
+    return f"{debut}:{get_column_letter(max_col)}{max_row}"
+
+# -----------------------------------------------------------------------------
+# Chargeur partagé : une seule lecture du classeur par version, publiée aux consommateurs
+# -----------------------------------------------------------------------------
+
+# Version publiée du classeur : numéro croissant, signature (CRC), feuilles lues et grilles figées
+VersionClasseur = namedtuple("VersionClasseur", ["numero", "signature", "feuilles", "grilles"])
+
+def figer_grille(grille):
+    """
+    Retourne une copie en lecture seule d'une grille (cellules, fusions et index des fusions),
+    pour qu'elle puisse être partagée sans risque entre les threads.
+    """
+    index = index_fusions(grille)
+    return MappingProxyType({
+        "cellules": MappingProxyType({cle: MappingProxyType(cellule) for cle, cellule in grille["cellules"].items()}),
+        "fusions": tuple(grille["fusions"]),
+        "index_fusions": index,
+    })
+
+class ChargeurClasseur:
+    """
+    Lit le classeur au plus une fois par modification et publie une version immuable
+    (VersionClasseur) partagée par tous les consommateurs : la surveillance du journal
+    (ModifThread) et la génération de l'agenda (AgendaThread).
+    - actualiser() relit le classeur seulement si sa signature a changé, sinon retourne la version courante ;
+    - attendre_version(numero) bloque jusqu'à la publication d'une version plus récente ;
+    - surveiller() est la boucle du thread de chargement, réveillée par inotify ou l'interrogation périodique.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.condition = threading.Condition()
+        self.verrou_lecture = threading.Lock()
+
+    def actualiser(self):
+        with self.verrou_lecture:
+            courante = self.version
+            signature = signature_classeur()
+            if courante is not None and signature is not None and signature == courante.signature:
+                return courante
+            feuilles = resoudre_feuilles()
+            grilles = {feuille: figer_grille(grille) for feuille, grille in lire_grilles(feuilles).items()}
+            version = VersionClasseur(courante.numero + 1 if courante else 1, signature,
+                                      tuple(grilles), MappingProxyType(grilles))
+            with self.condition:
+                self.version = version
+                self.condition.notify_all()
+            return version
+
+    def attendre_version(self, numero):
+        """Attend et retourne la première version publiée dont le numéro dépasse numero."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version is not None and self.version.numero > numero)
+            return self.version
+
+    def surveiller(self):
+        """Boucle infinie : relit le classeur à chaque enregistrement détecté."""
+        surveillant = creer_surveillant()
+        while True:
+            try:
+                self.actualiser()
+            except Exception as e:
+                print(f"⚠️ Erreur de lecture du classeur : {e}")
+            try:
+                attendre_modification(surveillant)
+            except OSError as e:
+                # Dossier supprimé ou démonté, lecture inotify en échec : repli sur l'interrogation périodique
+                print(f"⚠️ Surveillance inotify interrompue ({e}), interrogation toutes les {INTERVALLE_MODIF} s.")
+                try:
+                    surveillant.fermer()
+                except OSError:
+                    pass
+                surveillant = None
+
+CHARGEUR = ChargeurClasseur()
+
+# Changements détectés par la surveillance, transmis à la synchronisation de l'agenda :
+# (version précédente, nouvelle version, clés des cellules modifiées)
+FILE_SYNCHRO = queue.Queue()
+
+# Codes entiers des lieux utilisés dans les instantanés (0 : aucun lieu)
+LIEUX = [""] + sorted(set(COLOR_TO_LOCATION.values()))
+CODES_LIEUX = {lieu: code for code, lieu in enumerate(LIEUX)}
+
+def empreinte_cellule(valeur, code_lieu, commentaire):
+    """
+    Empreinte (entier 64 bits) d'une cellule : deux cellules de même contenu ont la même empreinte.
+    BLAKE2b sur le type et la représentation du contenu, et non hash() : hash(-1) == hash(-2)
+    et les grands entiers se confondent modulo 2**61 - 1, ce qui masquerait des modifications.
+    """
+    contenu = repr((type(valeur).__name__, valeur, code_lieu, commentaire)).encode("utf-8", "surrogatepass")
+    return int.from_bytes(hashlib.blake2b(contenu, digest_size=8).digest(), "little", signed=True)
+
+# Empreinte d'une cellule absente de l'état précédent (équivalente à une cellule vide)
+EMPREINTE_VIDE = empreinte_cellule(None, 0, "")
+
+class EtatExcel:
+    """
+    Instantané des cellules surveillées, stocké en colonnes parallèles :
+    - cles : liste des clés (feuille, coordonnée), positions : clé -> indice
+    - valeurs et commentaires : listes (chaînes internées)
+    - lieux : tableau NumPy des codes de lieu (voir LIEUX)
+    - empreintes : tableau NumPy des empreintes (valeur, lieu, commentaire) de chaque cellule
+    La comparaison de deux instantanés se fait en une seule opération sur les empreintes ;
+    le contenu complet n'est reconstruit que pour les cellules modifiées (voir cellule()).
+    """
+
+    def __init__(self):
+        self.cles = []
+        self.positions = {}
+        self.valeurs = []
+        self.commentaires = []
+        self.lieux = []
+        self.empreintes = []
+
+    def definir(self, cle, valeur, lieu, commentaire):
+        """Ajoute (ou remplace, pour une plage fusionnée) le contenu d'une cellule."""
+        if isinstance(valeur, str):
+            valeur = sys.intern(valeur)
+        commentaire = sys.intern(commentaire)
+        code = CODES_LIEUX[lieu]
+        empreinte = empreinte_cellule(valeur, code, commentaire)
+        i = self.positions.get(cle)
+        if i is None:
+            self.positions[cle] = len(self.cles)
+            self.cles.append(cle)
+            self.valeurs.append(valeur)
+            self.commentaires.append(commentaire)
+            self.lieux.append(code)
+            self.empreintes.append(empreinte)
+        else:
+            self.valeurs[i] = valeur
+            self.commentaires[i] = commentaire
+            self.lieux[i] = code
+            self.empreintes[i] = empreinte
+
+    def figer(self):
+        """Convertit les colonnes numériques en tableaux NumPy une fois l'instantané complet."""
+        self.lieux = np.array(self.lieux, dtype=np.int16)
+        self.empreintes = np.array(self.empreintes, dtype=np.int64)
+        return self
+
+    def __len__(self):
+        return len(self.cles)
+
+    def cellule(self, i):
+        """Reconstruit le contenu de la cellule d'indice i sous forme de dictionnaire."""
+        return {"valeur": self.valeurs[i], "lieu": LIEUX[self.lieux[i]], "commentaire": self.commentaires[i]}
+
+def charger_etat_excel(version=None):
+    """
+    Construit l'état des cellules du fichier Excel en tenant compte des cellules fusionnées,
+    à partir d'une version publiée par le chargeur partagé (par défaut la version courante).
+    Retourne un instantané EtatExcel indexé par (feuille, coordonnée), la coordonnée étant le tuple
+    (min_row, min_col, max_row, max_col) de la cellule ou de la plage fusionnée qui la contient.
+    """
+    if version is None:
+        version = CHARGEUR.actualiser()
+    etat = EtatExcel()
+    for feuille, grille in version.grilles.items():
+        index = index_fusions(grille)
+        for row in range(MIN_ROW, MAX_ROW + 1):
+            for col in range(MIN_COL, MAX_COL + 1):
+                cellule = grille["cellules"][(row, col)]
+                coord = plage_fusionnee(index, row, col) or (row, col, row, col)
+                lieu = COLOR_TO_LOCATION.get(cellule["couleur"][-6:], "")
+                etat.definir((feuille, coord), cellule["valeur"], lieu, cellule["commentaire"] or "")
+    return etat.figer()
 
 def format_cell_data(cell_data):
     """Formate les données d'une cellule pour affichage dans le CSV."""
@@ -141,60 +542,380 @@ def format_cell_data(cell_data):
 
 def comparer_etats(etat_precedent, etat_actuel):
     """
-    Compare deux états du fichier Excel et retourne les modifications détectées.
+    Compare deux états (EtatExcel) du fichier Excel et retourne les modifications détectées.
+    Les cellules modifiées sont obtenues en une seule comparaison des tableaux d'empreintes ;
+    lorsque la disposition des cellules a changé (fusions modifiées), les empreintes précédentes
+    sont d'abord réalignées sur les clés de l'état actuel.
+    Lorsque plusieurs feuilles sont surveillées, la cellule est notée "feuille!coordonnée".
+    Chaque modification conserve aussi sa clé (feuille, plage) pour la synchronisation incrémentale.
     """
+    if etat_precedent.cles == etat_actuel.cles:
+        indices_precedents = np.arange(len(etat_actuel))
+        empreintes_precedentes = etat_precedent.empreintes
+    else:
+        indices_precedents = np.array([etat_precedent.positions.get(cle, -1) for cle in etat_actuel.cles],
+                                      dtype=np.int64)
+        empreintes_precedentes = np.where(indices_precedents >= 0,
+                                          etat_precedent.empreintes[np.maximum(indices_precedents, 0)]
+                                          if len(etat_precedent) else EMPREINTE_VIDE,
+                                          EMPREINTE_VIDE)
+    modifiees = np.flatnonzero(empreintes_precedentes != etat_actuel.empreintes)
+
     modifications = []
-    for cle, nouvelle_donnee in etat_actuel.items():
-        ancienne_donnee = etat_precedent.get(cle, {"valeur": None, "lieu": "", "commentaire": ""})
-        if ancienne_donnee != nouvelle_donnee:
-            modifications.append({
-                "date": dt.now().strftime("%Y-%m-%d"),
-                "heure": dt.now().strftime("%H:%M:%S"),
-                "cellule": cle[1],
-                "ancienne_donnee": format_cell_data(ancienne_donnee),
-                "nouvelle_donnee": format_cell_data(nouvelle_donnee)
-            })
+    maintenant = dt.now()
+    date, heure = maintenant.strftime("%Y-%m-%d"), maintenant.strftime("%H:%M:%S")
+    plusieurs_feuilles = len({cle[0] for cle in etat_actuel.cles}) > 1
+    for i in modifiees:
+        cle = etat_actuel.cles[i]
+        j = indices_precedents[i]
+        ancienne_donnee = etat_precedent.cellule(j) if j >= 0 else {"valeur": None, "lieu": "", "commentaire": ""}
+        modifications.append({
+            "cle": cle,
+            "date": date,
+            "heure": heure,
+            "cellule": (f"{cle[0]}!" if plusieurs_feuilles else "") + format_coordonnees(cle[1]),
+            "ancienne_donnee": format_cell_data(ancienne_donnee),
+            "nouvelle_donnee": format_cell_data(etat_actuel.cellule(i))
+        })
     return modifications
 
+ENTETE_JOURNAL = ["Date", "Heure", "Cellule", "Ancienne Donnée", "Nouvelle Donnée"]
+
+class JournalModifications:
+    """
+    Écrivain du journal des modifications (CSV) gardé ouvert entre deux écritures :
+    - un seul descripteur en mode ajout, avec tampon, et un compteur de lignes tenu à jour
+      (le fichier n'est relu qu'une fois, à l'ouverture) ;
+    - politique de synchronisation disque (fsync) : "jamais", "lot" (après chaque lot) ou "toujours" (chaque ligne) ;
+    - rotation par taille (taille_max en octets, 0 pour désactiver) et/ou par période ("jour" ou "mois"),
+      avec compression gzip facultative de l'ancien fichier ;
+    - création atomique : l'en-tête est écrit dans un fichier temporaire renommé ensuite,
+      si bien que le journal n'existe jamais sans son en-tête.
+    """
+
+    def __init__(self, chemin, fsync="lot", taille_max=0, rotation="", compression=False):
+        self.chemin = chemin
+        self.fsync = fsync
+        self.taille_max = taille_max
+        self.rotation = rotation
+        self.compression = compression
+        self.verrou = threading.Lock()
+        self.fichier = None
+        self.nb_lignes = 0
+        self.periode = None
+
+    def _periode(self, instant):
+        if self.rotation == "jour":
+            return instant.strftime("%Y-%m-%d")
+        if self.rotation == "mois":
+            return instant.strftime("%Y-%m")
+        return None
+
+    def _ouvrir(self):
+        if not os.path.exists(self.chemin):
+            temporaire = f"{self.chemin}.{os.getpid()}.tmp"
+            with open(temporaire, mode="w", newline="", encoding="utf-8") as file:
+                csv.writer(file, quoting=csv.QUOTE_ALL).writerow(ENTETE_JOURNAL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporaire, self.chemin)
+            self.nb_lignes = 0
+        else:
+            with open(self.chemin, mode="r", newline="", encoding="utf-8") as file:
+                self.nb_lignes = max(sum(1 for _ in csv.reader(file)) - 1, 0)
+        self.periode = self._periode(dt.fromtimestamp(os.path.getmtime(self.chemin)))
+        self.fichier = open(self.chemin, mode="a", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.fichier, quoting=csv.QUOTE_ALL)
+
+    def _doit_tourner(self, maintenant):
+        if self.nb_lignes == 0:
+            return False
+        if self.taille_max and self.fichier.tell() >= self.taille_max:
+            return True
+        return self.rotation in ("jour", "mois") and self._periode(maintenant) != self.periode
+
+    def _tourner(self, maintenant):
+        """
+        Archive le journal courant (éventuellement compressé) et en recommence un nouveau.
+        L'archive porte la période qu'elle contient (changement de jour ou de mois),
+        ou l'heure d'archivage (rotation par taille).
+        """
+        self.fichier.close()
+        self.fichier = None
+        base, extension = os.path.splitext(self.chemin)
+        if self.periode is not None and self._periode(maintenant) != self.periode:
+            horodatage = self.periode.replace("-", "")
+        else:
+            horodatage = maintenant.strftime('%Y%m%d_%H%M%S')
+        archive = f"{base}_{horodatage}{extension}"
+        numero = 1
+        while os.path.exists(archive) or os.path.exists(archive + ".gz"):
+            numero += 1
+            archive = f"{base}_{horodatage}_{numero}{extension}"
+        os.replace(self.chemin, archive)
+        if self.compression:
+            with open(archive, "rb") as source, gzip.open(archive + ".gz", "wb") as destination:
+                shutil.copyfileobj(source, destination)
+            os.remove(archive)
+            archive += ".gz"
+        print(f"[Modifications] Journal archivé : {archive}")
+        self._ouvrir()
+
+    def ecrire(self, modifications):
+        """Ajoute les modifications au journal et retourne le nombre total de lignes du journal courant."""
+        with self.verrou:
+            maintenant = dt.now()
+            if self.fichier is None:
+                self._ouvrir()
+            if self._doit_tourner(maintenant):
+                self._tourner(maintenant)
+            for modif in modifications:
+                self.writer.writerow([
+                    modif["date"],
+                    modif["heure"],
+                    modif["cellule"],
+                    modif["ancienne_donnee"],
+                    modif["nouvelle_donnee"]
+                ])
+                self.nb_lignes += 1
+                if self.fsync == "toujours":
+                    self.fichier.flush()
+                    os.fsync(self.fichier.fileno())
+            self.fichier.flush()
+            if self.fsync == "lot":
+                os.fsync(self.fichier.fileno())
+            self.periode = self._periode(maintenant)
+            return self.nb_lignes
+
+    def fermer(self):
+        with self.verrou:
+            if self.fichier is not None:
+                self.fichier.close()
+                self.fichier = None
+
+def extraire_sujets(donnee):
+    """
+    Extrait les codes de sujets ("701_12", "704"...) de la partie "valeur" d'une donnée du journal
+    (format de format_cell_data) et retourne la liste des couples (sujet, UE), l'UE étant
+    le code à trois chiffres ("701" pour "701_12").
+    """
+    valeur = donnee.split(" | ")[0]
+    if valeur.startswith("valeur: "):
+        valeur = valeur[len("valeur: "):]
+    return [(m.group(0), m.group(1)) for m in re.finditer(r"\b(\d{3})(?:_\w+)?", valeur)]
+
+def _decouper_cellule(cellule):
+    """Découpe "feuille!E12:F12" en (feuille, min_row, min_col, max_row, max_col) ; feuille vaut "" si absente."""
+    feuille, _, coord = cellule.rpartition("!")
+    min_col, min_row, max_col, max_row = range_boundaries(coord)
+    return feuille, min_row, min_col, max_row, max_col
+
+class BaseJournal:
+    """
+    Journal des modifications dans une base SQLite, indexée par date, par cellule
+    (bornes entières de la cellule ou de la plage fusionnée) et par sujet / UE,
+    pour que les recherches ne ralentissent pas avec la taille du journal.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS modifications (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            heure TEXT NOT NULL,
+            cellule TEXT NOT NULL,
+            feuille TEXT,
+            min_row INTEGER, min_col INTEGER, max_row INTEGER, max_col INTEGER,
+            ancienne_donnee TEXT,
+            nouvelle_donnee TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_modifications_date ON modifications (date, heure);
+        CREATE INDEX IF NOT EXISTS idx_modifications_cellule ON modifications (feuille, min_row, min_col);
+        CREATE INDEX IF NOT EXISTS idx_modifications_position ON modifications (min_row, min_col);
+        CREATE TABLE IF NOT EXISTS modifications_sujets (
+            modification_id INTEGER NOT NULL REFERENCES modifications (id),
+            sujet TEXT NOT NULL,
+            ue TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sujets_ue ON modifications_sujets (ue, modification_id);
+        CREATE INDEX IF NOT EXISTS idx_sujets_sujet ON modifications_sujets (sujet, modification_id);
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self.verrou = threading.Lock()
+        self.connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        self.connexion.executescript(self.SCHEMA)
+
+    def ajouter(self, modifications, feuille_defaut=None):
+        """
+        Ajoute les modifications (format de comparer_etats) en une seule transaction.
+        La feuille enregistrée est celle de la clé de la modification, même si la cellule
+        du journal ne la mentionne pas (une seule feuille surveillée) ; à défaut, celle de la cellule,
+        puis feuille_defaut (NULL si aucune).
+        """
+        with self.verrou, self.connexion:
+            for modif in modifications:
+                feuille, min_row, min_col, max_row, max_col = _decouper_cellule(modif["cellule"])
+                if "cle" in modif:
+                    feuille = modif["cle"][0]
+                feuille = feuille or feuille_defaut
+                curseur = self.connexion.execute(
+                    "INSERT INTO modifications (date, heure, cellule, feuille, min_row, min_col, max_row, max_col,"
+                    " ancienne_donnee, nouvelle_donnee) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (modif["date"], modif["heure"], modif["cellule"], feuille, min_row, min_col, max_row, max_col,
+                     modif["ancienne_donnee"], modif["nouvelle_donnee"]))
+                sujets = set(extraire_sujets(modif["ancienne_donnee"]) + extraire_sujets(modif["nouvelle_donnee"]))
+                self.connexion.executemany(
+                    "INSERT INTO modifications_sujets (modification_id, sujet, ue) VALUES (?, ?, ?)",
+                    [(curseur.lastrowid, sujet, ue) for sujet, ue in sujets])
+
+    def rechercher(self, cellule=None, debut=None, fin=None, ue=None, limite=None):
+        """
+        Retourne les modifications (dictionnaires au format du journal CSV), de la plus ancienne
+        à la plus récente, filtrées par :
+        - cellule : "H17" ou "M1 2324!H17" (les plages fusionnées contenant la cellule sont incluses)
+        - debut / fin : dates "AAAA-MM-JJ" incluses
+        - ue : code d'UE ("701") ou de sujet ("701_12")
+        """
+        conditions, parametres = [], []
+        if cellule:
+            feuille, row, col, _, _ = _decouper_cellule(cellule)
+            if feuille:
+                conditions.append("feuille = ?")
+                parametres.append(feuille)
+            conditions.append("min_row <= ? AND max_row >= ? AND min_col <= ? AND max_col >= ?")
+            parametres += [row, row, col, col]
+        if debut:
+            conditions.append("date >= ?")
+            parametres.append(debut)
+        if fin:
+            conditions.append("date <= ?")
+            parametres.append(fin)
+        if ue:
+            conditions.append("id IN (SELECT modification_id FROM modifications_sujets WHERE ue = ? OR sujet = ?)")
+            parametres += [ue, ue]
+        requete = "SELECT date, heure, cellule, ancienne_donnee, nouvelle_donnee FROM modifications"
+        if conditions:
+            requete += " WHERE " + " AND ".join(conditions)
+        requete += " ORDER BY date, heure, id"
+        if limite:
+            requete += f" LIMIT {int(limite)}"
+        with self.verrou:
+            lignes = self.connexion.execute(requete, parametres).fetchall()
+        return [dict(zip(("date", "heure", "cellule", "ancienne_donnee", "nouvelle_donnee"), ligne))
+                for ligne in lignes]
+
+    def exporter_csv(self, chemin_csv, **filtres):
+        """Exporte les modifications (éventuellement filtrées) au format de journal_modifications.csv."""
+        modifications = self.rechercher(**filtres)
+        with open(chemin_csv, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+            writer.writerow(ENTETE_JOURNAL)
+            for modif in modifications:
+                writer.writerow([modif["date"], modif["heure"], modif["cellule"],
+                                 modif["ancienne_donnee"], modif["nouvelle_donnee"]])
+        return len(modifications)
+
+    def importer_csv(self, chemin_csv):
+        """
+        Importe un journal CSV existant (par exemple l'historique antérieur à la base).
+        Les cellules notées sans feuille sont rattachées à la feuille surveillée si sheet_name
+        n'en désigne qu'une, sinon leur feuille reste inconnue (NULL).
+        """
+        with open(chemin_csv, mode="r", newline="", encoding="utf-8") as file:
+            lignes = list(csv.reader(file))[1:]
+        try:
+            feuilles = resoudre_feuilles()
+        except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError):
+            feuilles = []
+        self.ajouter([{"date": l[0], "heure": l[1], "cellule": l[2], "ancienne_donnee": l[3],
+                       "nouvelle_donnee": l[4]} for l in lignes if len(l) >= 5],
+                     feuille_defaut=feuilles[0] if len(feuilles) == 1 else None)
+        return len(lignes)
+
+_journal = None
+_base_journal = None
+
 def enregistrer_modifications(modifications):
     """
-    Enregistre les modifications détectées dans un fichier CSV.
+    Enregistre les modifications détectées dans le fichier CSV du journal
+    (écrivain unique, ouvert au premier appel et conservé ensuite) et, si elle est configurée,
+    dans la base SQLite indexée du journal.
+    """
+    global _journal, _base_journal
+    if _journal is None:
+        _journal = JournalModifications(
+            CSV_MODIFICATIONS,
+            fsync=JOURNAL_FSYNC,
+            taille_max=int(JOURNAL_TAILLE_MAX_MO * 1024 * 1024),
+            rotation=JOURNAL_ROTATION,
+            compression=JOURNAL_COMPRESSION,
+        )
+    nb_lignes = _journal.ecrire(modifications)
+    if JOURNAL_SQLITE:
+        if _base_journal is None:
+            _base_journal = BaseJournal(JOURNAL_SQLITE)
+        _base_journal.ajouter(modifications)
+    print(f"[Modifications] Journal : {nb_lignes} modification(s) enregistrée(s) au total.")
+
+class HistoriqueModifications:
+    """
+    Mémoire bornée des modifications déjà enregistrées, pour ne pas journaliser deux fois
+    la même modification. Chaque modification est repérée par la clé (cellule, ancienne donnée,
+    nouvelle donnée) dans un dictionnaire ordonné : test et ajout en temps constant, éviction
+    des plus anciennes clés au-delà de la capacité.
+    Seule la dernière modification de chaque cellule est retenue : un aller-retour A -> B -> A -> B
+    reste ainsi entièrement journalisé, alors qu'une même modification détectée deux fois ne l'est qu'une fois.
     """
-    fichier_existe = os.path.exists(CSV_MODIFICATIONS)
-    with open(CSV_MODIFICATIONS, mode="a", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
-        if not fichier_existe:
-            writer.writerow(["Date", "Heure", "Cellule", "Ancienne Donnée", "Nouvelle Donnée"])
+
+    def __init__(self, capacite):
+        self.capacite = capacite
+        self.cles = OrderedDict()
+        self.derniere_par_cellule = {}
+
+    def filtrer_nouvelles(self, modifications):
+        """Retourne les modifications pas encore vues et les mémorise."""
+        nouvelles = []
         for modif in modifications:
-            writer.writerow([
-                modif["date"],
-                modif["heure"],
-                modif["cellule"],
-                modif["ancienne_donnee"],
-                modif["nouvelle_donnee"]
-            ])
-    with open(CSV_MODIFICATIONS, mode="r", encoding="utf-8") as file:
-        data = file.readlines()
-    print(f"[Modifications] CSV rechargé ({len(data)} lignes).")
+            cle = (modif["cellule"], modif["ancienne_donnee"], modif["nouvelle_donnee"])
+            if cle in self.cles:
+                self.cles.move_to_end(cle)
+                continue
+            precedente = self.derniere_par_cellule.get(modif["cellule"])
+            if precedente is not None:
+                self.cles.pop(precedente, None)
+            self.cles[cle] = None
+            self.derniere_par_cellule[modif["cellule"]] = cle
+            nouvelles.append(modif)
+            while len(self.cles) > self.capacite:
+                ancienne, _ = self.cles.popitem(last=False)
+                if self.derniere_par_cellule.get(ancienne[0]) == ancienne:
+                    del self.derniere_par_cellule[ancienne[0]]
+        return nouvelles
 
 def surveiller_excel():
     """
     Boucle infinie de surveillance des modifications dans le fichier Excel.
+    Chaque nouvelle version publiée par le chargeur partagé (CHARGEUR) est comparée à la précédente ;
+    le classeur n'est donc pas relu ici.
     """
-    historique_modifications = []
-    etat_precedent = charger_etat_excel()
-    print("🔄 Surveillance des modifications Excel lancée sur la feuille", SHEET_NAME)
+    historique_modifications = HistoriqueModifications(CAPACITE_HISTORIQUE)
+    version = CHARGEUR.actualiser()
+    etat_precedent = charger_etat_excel(version)
+    print("🔄 Surveillance des modifications Excel lancée sur la (les) feuille(s)", ", ".join(version.feuilles))
     while True:
         try:
-            time.sleep(INTERVALLE_MODIF)
-            etat_actuel = charger_etat_excel()
+            version_precedente = version
+            version = CHARGEUR.attendre_version(version.numero)
+            etat_actuel = charger_etat_excel(version)
             modifications = comparer_etats(etat_precedent, etat_actuel)
-            nouvelles_modifications = [modif for modif in modifications if modif not in historique_modifications]
+            # Les cellules modifiées pilotent la synchronisation incrémentale de l'agenda
+            FILE_SYNCHRO.put((version_precedente, version, [modif["cle"] for modif in modifications]))
+            nouvelles_modifications = historique_modifications.filtrer_nouvelles(modifications)
             if nouvelles_modifications:
                 enregistrer_modifications(nouvelles_modifications)
                 print(f"✅ {len(nouvelles_modifications)} modification(s) enregistrée(s) à {dt.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                historique_modifications.extend(nouvelles_modifications)
-                historique_modifications = historique_modifications[-100:]
             etat_precedent = etat_actuel
         except Exception as e:
             print(f"⚠️ Erreur de surveillance : {e}")
@@ -281,96 +1002,411 @@ def split_subject_into_events(subject, date_str, halfday_label, location, descri
         events.append([subject, date_str, start_time, end_time, location, description])
     return events
 
-def process_agenda():
+def lire_grille_openpyxl(ws):
+    """
+    Lit en une seule passe la zone d'intérêt d'une feuille openpyxl (ligne d'en-têtes
+    comprise) et retourne la grille des cellules :
+    - "cellules" : dictionnaire (ligne, colonne) -> {"valeur", "couleur", "commentaire"}
+    - "fusions" : liste des plages fusionnées de la feuille (min_col, min_row, max_col, max_row)
+    """
+    cellules = {}
+    for row in ws.iter_rows(min_row=MIN_ROW - 1, max_row=MAX_ROW, min_col=MIN_COL, max_col=MAX_COL):
+        for cell in row:
+            rgb = cell.fill.fgColor.rgb if cell.fill and cell.fill.fgColor else None
+            cellules[(cell.row, cell.column)] = {
+                "valeur": cell.value,
+                "couleur": rgb if isinstance(rgb, str) else "",
+                "commentaire": cell.comment.text if cell.comment else None,
+            }
+    fusions = [merge_range.bounds for merge_range in ws.merged_cells.ranges]
+    return {"cellules": cellules, "fusions": fusions}
+
+# Espaces de noms XML du format .xlsx (SpreadsheetML)
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def _chemin_relation(dossier, cible):
+    """Résout la cible d'une relation (relative au dossier de la partie ou absolue) en nom de membre zip."""
+    if cible.startswith("/"):
+        return cible.lstrip("/")
+    return posixpath.normpath(posixpath.join(dossier, cible))
+
+def _lire_relations(archive, chemin_rels):
+    """Retourne les relations d'une partie sous la forme {Id: (Type, nom du membre zip)}."""
+    if chemin_rels not in archive.namelist():
+        return {}
+    dossier = posixpath.dirname(posixpath.dirname(chemin_rels))
+    relations = {}
+    for rel in ET.fromstring(archive.read(chemin_rels)).iter(NS_PKG_REL + "Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        relations[rel.get("Id")] = (rel.get("Type", ""), _chemin_relation(dossier, rel.get("Target", "")))
+    return relations
+
+def _texte_riche(elem):
+    """Concatène le texte d'un élément <si> ou <text> (texte simple et runs, sans les indications phonétiques)."""
+    morceaux = []
+    for enfant in elem:
+        if enfant.tag == NS_MAIN + "t":
+            morceaux.append(enfant.text or "")
+        elif enfant.tag == NS_MAIN + "r":
+            t = enfant.find(NS_MAIN + "t")
+            if t is not None:
+                morceaux.append(t.text or "")
+    return "".join(morceaux)
+
+def _lire_styles(archive):
+    """
+    Lit la table des styles et retourne, pour chaque index de style de cellule (cellXfs),
+    le couple (couleur de remplissage, format de nombre).
+    """
+    if "xl/styles.xml" not in archive.namelist():
+        return []
+    racine = ET.fromstring(archive.read("xl/styles.xml"))
+    formats = dict(BUILTIN_FORMATS)
+    for num_fmt in racine.iter(NS_MAIN + "numFmt"):
+        formats[int(num_fmt.get("numFmtId"))] = num_fmt.get("formatCode", "")
+    couleurs_fills = []
+    fills = racine.find(NS_MAIN + "fills")
+    for fill in (fills if fills is not None else []):
+        pattern = fill.find(NS_MAIN + "patternFill")
+        couleur = "00000000"
+        if pattern is not None:
+            fg = pattern.find(NS_MAIN + "fgColor")
+            if fg is not None:
+                rgb = fg.get("rgb")
+                # Couleurs de thème / indexées : openpyxl ne fournit pas de valeur RGB
+                couleur = ("00" + rgb if len(rgb) == 6 else rgb) if rgb else ""
+        else:
+            couleur = ""
+        couleurs_fills.append(couleur)
+    styles = []
+    cell_xfs = racine.find(NS_MAIN + "cellXfs")
+    for xf in (cell_xfs if cell_xfs is not None else []):
+        fill_id = int(xf.get("fillId", 0))
+        couleur = couleurs_fills[fill_id] if fill_id < len(couleurs_fills) else "00000000"
+        styles.append((couleur, formats.get(int(xf.get("numFmtId", 0)), "General")))
+    return styles
+
+def _lire_chaines_partagees(archive, indices):
+    """Parcourt en flux la table des chaînes partagées et ne conserve que les indices demandés."""
+    chaines = {}
+    if not indices or "xl/sharedStrings.xml" not in archive.namelist():
+        return chaines
+    dernier = max(indices)
+    with archive.open("xl/sharedStrings.xml") as flux:
+        index = 0
+        for _, elem in ET.iterparse(flux, events=("end",)):
+            if elem.tag != NS_MAIN + "si":
+                continue
+            if index in indices:
+                chaines[index] = _texte_riche(elem)
+            elem.clear()
+            index += 1
+            if index > dernier:
+                break
+    return chaines
+
+# Lecture en flux d'une feuille : taille des blocs décompressés, et balise <mergeCell ref="..."> recherchée
+# directement dans les octets une fois la zone dépassée (préfixe d'espace de noms éventuel)
+TAILLE_BLOC_XML = 1 << 16
+RE_FUSION_XML = re.compile(rb'<(?:[A-Za-z_][\w.-]*:)?mergeCell(?=\s)[^>]*?\sref="([^"]+)"')
+
+def _fusions_brutes(blocs):
+    """
+    Retourne les plages fusionnées (bornes comme range_boundaries) trouvées dans les blocs d'octets XML,
+    sans analyse XML : seules les balises <mergeCell> sont recherchées. Une balise coupée entre deux
+    blocs est reportée sur le bloc suivant.
+    """
+    fusions, reste = [], b""
+    for bloc in blocs:
+        tampon = reste + bloc
+        coupure = tampon.rfind(b"<")
+        if coupure < 0:
+            coupure = len(tampon)
+        fusions += [range_boundaries(ref.decode("ascii")) for ref in RE_FUSION_XML.findall(tampon, 0, coupure)]
+        reste = tampon[coupure:]
+    fusions += [range_boundaries(ref.decode("ascii")) for ref in RE_FUSION_XML.findall(reste)]
+    return fusions
+
+def _convertir_valeur(brute, type_cellule, format_nombre, epoch):
+    """Convertit la valeur brute d'une cellule (hors chaînes partagées) comme le fait openpyxl."""
+    if type_cellule == "b":
+        return bool(int(brute))
+    if type_cellule in ("str", "e", "inlineStr"):
+        return brute
+    if type_cellule == "d":
+        return from_ISO8601(brute)
+    valeur = float(brute) if ("." in brute or "E" in brute or "e" in brute) else int(brute)
+    if is_date_format(format_nombre):
+        return from_excel(valeur, epoch, timedelta=is_timedelta_format(format_nombre))
+    return valeur
+
+def _lire_ligne_xml(elem, ligne, brutes):
+    """Ajoute à brutes les cellules (valeur brute, type, style) d'un élément <row> comprises entre MIN_COL et MAX_COL."""
+    colonne = 0
+    for c in elem.iter(NS_MAIN + "c"):
+        ref = c.get("r")
+        colonne = column_index_from_string(ref.rstrip("0123456789")) if ref else colonne + 1
+        if not MIN_COL <= colonne <= MAX_COL:
+            continue
+        v = c.find(NS_MAIN + "v")
+        type_cellule = c.get("t", "n")
+        if type_cellule == "inlineStr":
+            inline = c.find(NS_MAIN + "is")
+            brute = _texte_riche(inline) if inline is not None else None
+        else:
+            brute = v.text if v is not None else None
+        brutes[(ligne, colonne)] = (brute, type_cellule, int(c.get("s", 0)))
+
+def lire_grille_xml(chemin, sheet_name):
     """
-    Traite la feuille Excel pour générer le CSV (OUTPUT_CSV) contenant les événements.
-    Le script récupère le formatage (couleurs, commentaires, cellules fusionnées),
-    extrait les événements en fonction des en-têtes et synchronise ensuite avec Google Calendar.
+    Lit la zone d'intérêt d'une feuille en parcourant directement le XML du classeur,
+    sans construire le modèle objet d'openpyxl : la feuille est lue en flux et seules
+    les lignes MIN_ROW - 1 à MAX_ROW sont analysées ; au-delà de MAX_ROW, le reste de la feuille
+    n'est plus analysé en XML, seules les plages fusionnées (<mergeCells>, après les lignes) y sont
+    recherchées. Les chaînes partagées et les commentaires ne sont résolus que pour les cellules
+    de la zone, les couleurs via l'index de style.
+    Retourne la même grille que lire_grille_openpyxl.
+    Lève KeyError si la feuille n'existe pas.
     """
-    events_global = []
-    wb_orig = load_workbook(FILE_PATH)
+    with zipfile.ZipFile(chemin) as archive:
+        classeur = ET.fromstring(archive.read("xl/workbook.xml"))
+        workbook_pr = classeur.find(NS_MAIN + "workbookPr")
+        date1904 = workbook_pr is not None and workbook_pr.get("date1904") in ("1", "true")
+        epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        rel_id = None
+        for feuille in classeur.iter(NS_MAIN + "sheet"):
+            if feuille.get("name") == sheet_name:
+                rel_id = feuille.get(NS_REL + "id")
+        if rel_id is None:
+            raise KeyError(sheet_name)
+        chemin_feuille = _lire_relations(archive, "xl/_rels/workbook.xml.rels")[rel_id][1]
+        styles = _lire_styles(archive)
+
+        # Parcours en flux de la feuille : seules les cellules de la zone sont conservées
+        brutes = {}
+        fusions = []
+        with archive.open(chemin_feuille) as flux:
+            analyseur = ET.XMLPullParser(events=("end",))
+            blocs = iter(lambda: flux.read(TAILLE_BLOC_XML), b"")
+            ligne, fin_zone = 0, False
+            for bloc in blocs:
+                analyseur.feed(bloc)
+                for _, elem in analyseur.read_events():
+                    if elem.tag == NS_MAIN + "row":
+                        ligne = int(elem.get("r", ligne + 1))
+                        if ligne > MAX_ROW:
+                            fin_zone = True
+                            break
+                        if ligne >= MIN_ROW - 1:
+                            _lire_ligne_xml(elem, ligne, brutes)
+                        elem.clear()
+                    elif elem.tag == NS_MAIN + "mergeCell":
+                        fusions.append(range_boundaries(elem.get("ref")))
+                if fin_zone:
+                    # Les lignes sont triées et les fusions les suivent : le bloc courant et les suivants
+                    # ne sont plus parcourus que pour les balises <mergeCell>
+                    fusions += _fusions_brutes(itertools.chain([bloc], blocs))
+                    break
+
+        # Résolution des chaînes partagées nécessaires uniquement
+        indices = {int(b[0]) for b in brutes.values() if b[1] == "s" and b[0] is not None}
+        chaines = _lire_chaines_partagees(archive, indices)
+
+        # Commentaires de la feuille
+        commentaires = {}
+        dossier_feuille = posixpath.dirname(chemin_feuille)
+        rels_feuille = posixpath.join(dossier_feuille, "_rels", posixpath.basename(chemin_feuille) + ".rels")
+        for type_rel, membre in _lire_relations(archive, rels_feuille).values():
+            if not type_rel.endswith("/comments"):
+                continue
+            with archive.open(membre) as flux:
+                for _, elem in ET.iterparse(flux, events=("end",)):
+                    if elem.tag != NS_MAIN + "comment":
+                        continue
+                    col, row = coordinate_to_tuple(elem.get("ref"))[::-1]
+                    if MIN_ROW - 1 <= row <= MAX_ROW and MIN_COL <= col <= MAX_COL:
+                        texte = elem.find(NS_MAIN + "text")
+                        commentaires[(row, col)] = _texte_riche(texte) if texte is not None else ""
+                    elem.clear()
+
+    cellules = {}
+    for row in range(MIN_ROW - 1, MAX_ROW + 1):
+        for col in range(MIN_COL, MAX_COL + 1):
+            brute, type_cellule, style = brutes.get((row, col), (None, "n", 0))
+            couleur, format_nombre = styles[style] if style < len(styles) else ("00000000", "General")
+            if brute is None:
+                valeur = None
+            elif type_cellule == "s":
+                valeur = chaines.get(int(brute))
+            else:
+                valeur = _convertir_valeur(brute, type_cellule, format_nombre, epoch)
+            cellules[(row, col)] = {
+                "valeur": valeur,
+                "couleur": couleur,
+                "commentaire": commentaires.get((row, col)),
+            }
+    # Comme openpyxl, les cellules couvertes par une fusion (hors cellule en haut à gauche) sont vides
+    for min_col, min_row, max_col, max_row in fusions:
+        for row in range(max(min_row, MIN_ROW - 1), min(max_row, MAX_ROW) + 1):
+            for col in range(max(min_col, MIN_COL), min(max_col, MAX_COL) + 1):
+                if (row, col) != (min_row, min_col):
+                    cellules[(row, col)] = {"valeur": None, "couleur": "00000000", "commentaire": None}
+    return {"cellules": cellules, "fusions": fusions}
+
+def lire_grille(sheet_name, chemin=None, backend=None):
+    """
+    Lit la grille d'une feuille du classeur (FILE_PATH par défaut) avec le moteur choisi
+    dans config.txt (backend_extraction = openpyxl ou xml).
+    Lève KeyError si la feuille n'existe pas.
+    """
+    chemin = chemin or FILE_PATH
+    backend = backend or BACKEND_EXTRACTION
+    if backend == "xml":
+        return lire_grille_xml(chemin, sheet_name)
+    wb = load_workbook(chemin, data_only=True)
+    try:
+        return lire_grille_openpyxl(wb[sheet_name])
+    finally:
+        wb.close()
+
+def lister_feuilles(chemin=None):
+    """Retourne les noms des feuilles du classeur, dans l'ordre, en lisant uniquement xl/workbook.xml."""
+    with zipfile.ZipFile(chemin or FILE_PATH) as archive:
+        classeur = ET.fromstring(archive.read("xl/workbook.xml"))
+    return [feuille.get("name") for feuille in classeur.iter(NS_MAIN + "sheet")]
+
+def resoudre_feuilles(motifs=None):
+    """
+    Résout la valeur sheet_name de config.txt (noms ou motifs de type "M* 2324",
+    séparés par des virgules) en liste de feuilles existantes, sans doublon.
+    """
+    return _filtrer_feuilles(motifs or SHEET_NAME, lister_feuilles())
+
+def _filtrer_feuilles(motifs, disponibles, silencieux=False):
+    """Applique les noms / motifs (séparés par des virgules) à la liste des feuilles disponibles."""
+    feuilles = []
+    for motif in [m.strip() for m in motifs.split(",") if m.strip()]:
+        correspondances = fnmatch.filter(disponibles, motif) if any(c in motif for c in "*?[") else [motif]
+        if not correspondances and not silencieux:
+            print(f"Aucune feuille ne correspond à '{motif}' dans le fichier Excel.")
+        for feuille in correspondances:
+            if feuille not in feuilles:
+                feuilles.append(feuille)
+    return feuilles
+
+def _lire_grille_processus(args):
+    """Point d'entrée d'un processus de lecture : retourne (feuille, grille) ou (feuille, None) si absente."""
+    feuille, chemin, backend = args
     try:
-        ws_orig = wb_orig[SHEET_NAME]
+        return feuille, lire_grille(feuille, chemin, backend)
     except KeyError:
-        print(f"Feuille '{SHEET_NAME}' introuvable dans le fichier Excel.")
-        wb_orig.close()
-        return
+        return feuille, None
+
+_pool_processus = None
+_verrou_pool = threading.Lock()
+
+def _lire_grilles_pool(taches):
+    """
+    Répartit les lectures sur le pool de processus, réutilisé d'un cycle à l'autre.
+    Un pool cassé (processus tué) est remplacé et les lectures relancées une fois.
+    """
+    global _pool_processus
+    for essai in range(2):
+        with _verrou_pool:
+            if _pool_processus is None:
+                _pool_processus = ProcessPoolExecutor(max_workers=NB_PROCESSUS)
+            pool = _pool_processus
+        try:
+            return list(pool.map(_lire_grille_processus, taches))
+        except BrokenProcessPool:
+            with _verrou_pool:
+                if _pool_processus is pool:
+                    _pool_processus = None
+            pool.shutdown(wait=False)
+            if essai:
+                raise
+
+def _lire_grilles_openpyxl(feuilles):
+    """Lit les feuilles avec openpyxl en un seul chargement du classeur : [(feuille, grille ou None)]."""
+    wb = load_workbook(FILE_PATH, data_only=True)
+    try:
+        return [(feuille, lire_grille_openpyxl(wb[feuille]) if feuille in wb.sheetnames else None)
+                for feuille in feuilles]
+    finally:
+        wb.close()
+
+def lire_grilles(feuilles):
+    """
+    Lit les grilles de plusieurs feuilles. Avec openpyxl, qui charge tout le classeur, le classeur est chargé
+    une seule fois pour toutes les feuilles ; avec le moteur xml, qui ne lit que la partie de chaque feuille,
+    la lecture (limitée par le GIL) est répartie au-delà d'une feuille sur un pool de processus.
+    Retourne un dictionnaire {feuille: grille} dans l'ordre des feuilles ; les feuilles introuvables sont ignorées.
+    """
+    taches = [(feuille, FILE_PATH, BACKEND_EXTRACTION) for feuille in feuilles]
+    if BACKEND_EXTRACTION != "xml":
+        resultats = _lire_grilles_openpyxl(feuilles)
+    elif len(taches) <= 1 or NB_PROCESSUS <= 1:
+        resultats = map(_lire_grille_processus, taches)
+    else:
+        resultats = _lire_grilles_pool(taches)
+    grilles = {}
+    for feuille, grille in resultats:
+        if grille is None:
+            print(f"Feuille '{feuille}' introuvable dans le fichier Excel.")
+            continue
+        grilles[feuille] = grille
+    return grilles
+
+def propager_fusions(grille):
+    """
+    Recopie la valeur, la couleur et le commentaire de la cellule en haut à gauche
+    de chaque plage fusionnée (contenue dans la zone d'intérêt) sur toutes les cellules de la plage.
+    Retourne un nouveau dictionnaire de cellules, la grille d'origine n'est pas modifiée.
+    """
+    cellules = dict(grille["cellules"])
+    for min_col, min_row, max_col, max_row in grille["fusions"]:
+        if not (min_col >= MIN_COL and max_col <= MAX_COL and
+                min_row >= MIN_ROW - 1 and max_row <= MAX_ROW):
+            continue
+        haut_gauche = cellules[(min_row, min_col)]
+        for r in range(min_row, max_row + 1):
+            for c in range(min_col, max_col + 1):
+                cellule = dict(cellules[(r, c)])
+                cellule["valeur"] = haut_gauche["valeur"]
+                if haut_gauche["couleur"] and haut_gauche["couleur"] != "00000000":
+                    cellule["couleur"] = haut_gauche["couleur"]
+                if haut_gauche["commentaire"]:
+                    cellule["commentaire"] = haut_gauche["commentaire"]
+                cellules[(r, c)] = cellule
+    return cellules
+
+def extraire_evenements(grille, sheet_name, origines=None):
+    """
+    Extrait les événements directement depuis la grille des cellules (valeurs, couleurs,
+    commentaires et cellules fusionnées) d'une feuille.
+    Retourne la liste des événements [Subject, Date, Start Time, End Time, Location, Description],
+    ou None si les en-têtes de demi-journées sont absents.
+    Si une liste origines est fournie, la cellule source (feuille, ligne, colonne) de chaque
+    événement y est ajoutée, dans le même ordre.
+    """
+    events = []
+    cellules = propager_fusions(grille)
 
-    # Récupération des cellules fusionnées dans la zone d'intérêt
-    merged_cells = []
-    for merge_range in ws_orig.merged_cells.ranges:
-        if (merge_range.min_col >= 5 and merge_range.max_col <= 15 and 
-            merge_range.min_row >= 5 and merge_range.max_row <= 34):
-            merged_cells.append(merge_range)
-    
-    # Chargement du tableau dans un DataFrame avec pandas
-    df = pd.read_excel(FILE_PATH, sheet_name=SHEET_NAME,
-                       skiprows=4, usecols="E:O", header=0, engine="openpyxl")
-    df = df.iloc[:29]
-    
-    # Récupération des couleurs et commentaires dans la zone d'intérêt
-    cell_colors = {}
-    cell_comments = {}
-    for row_idx, row in enumerate(ws_orig.iter_rows(min_row=6, max_row=34, min_col=5, max_col=15), start=0):
-        for col_idx, cell in enumerate(row, start=0):
-            if cell.fill and cell.fill.fgColor and cell.fill.fgColor.rgb and cell.fill.fgColor.rgb != "00000000":
-                cell_colors[(row_idx, col_idx)] = cell.fill.fgColor.rgb
-            if cell.comment:
-                cell_comments[(row_idx, col_idx)] = cell.comment.text
-
-    # Écriture des données (sans formatage) dans un classeur Excel en mémoire
-    output = BytesIO()
-    df.to_excel(output, sheet_name=SHEET_NAME + "_modifie", index=False)
-    output.seek(0)
-    new_wb = load_workbook(output)
-    new_ws = new_wb[SHEET_NAME + "_modifie"]
-
-    # Application des couleurs et commentaires sur la nouvelle feuille
-    for row_idx in range(len(df)):
-        for col_idx in range(len(df.columns)):
-            cell = new_ws.cell(row=row_idx + 2, column=col_idx + 1)
-            if (row_idx, col_idx) in cell_colors:
-                color = cell_colors[(row_idx, col_idx)]
-                cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-            if (row_idx, col_idx) in cell_comments:
-                cell.comment = openpyxl.comments.Comment(cell_comments[(row_idx, col_idx)], "Author")
-
-    # Gestion des cellules fusionnées
-    for merge_range in merged_cells:
-        new_min_row = merge_range.min_row - 4
-        new_max_row = merge_range.max_row - 4
-        new_min_col = merge_range.min_col - 4
-        new_max_col = merge_range.max_col - 4
-        original_top_left = ws_orig.cell(row=merge_range.min_row, column=merge_range.min_col)
-        top_left_value = original_top_left.value
-        top_left_color = None
-        top_left_comment = original_top_left.comment.text if original_top_left.comment else None
-        if (original_top_left.fill and original_top_left.fill.fgColor and 
-            original_top_left.fill.fgColor.rgb and original_top_left.fill.fgColor.rgb != "00000000"):
-            top_left_color = original_top_left.fill.fgColor.rgb
-        for r in range(new_min_row, new_max_row + 1):
-            for c in range(new_min_col, new_max_col + 1):
-                new_cell = new_ws.cell(row=r, column=c)
-                new_cell.value = top_left_value
-                if top_left_color:
-                    new_cell.fill = PatternFill(start_color=top_left_color, end_color=top_left_color, fill_type="solid")
-                if top_left_comment:
-                    new_cell.comment = openpyxl.comments.Comment(top_left_comment, "Author")
-    
     # Récupération des en-têtes pour les demi-journées (la première colonne correspond à l'information de semaine)
-    headers = [cell.value for cell in new_ws[1] if cell.value is not None]
-    if len(headers) < 2:
-        print(f"En-têtes insuffisantes dans la feuille {SHEET_NAME}.")
-        wb_orig.close()
-        return
-    halfday_headers = headers[1:]
-    
+    headers = [cellules[(MIN_ROW - 1, col)]["valeur"] for col in range(MIN_COL, MAX_COL + 1)]
+    if len([h for h in headers if h is not None]) < 2:
+        print(f"En-têtes insuffisantes dans la feuille {sheet_name}.")
+        return None
+
     # Parcours des lignes pour extraire les événements
-    for row_idx, row in enumerate(new_ws.iter_rows(min_row=2), start=2):
-        week_cell = row[0]
-        if not week_cell or not week_cell.value:
+    for row in range(MIN_ROW, MAX_ROW + 1):
+        week_value = cellules[(row, MIN_COL)]["valeur"]
+        if not week_value:
             continue
-        week_info = str(week_cell.value).strip().lower()
+        week_info = str(week_value).strip().lower()
         match = re.search(r"(\d+)\s*-\s*(\d+)\s+([a-zA-Zéû\.]+)\s+(\d+)", week_info)
         if not match:
             continue
@@ -393,62 +1429,287 @@ def process_agenda():
             else:
                 monday_date = dt(year, month, day_start)
         except Exception as e:
-            print(f"Erreur de parsing sur '{week_info}' dans la feuille {SHEET_NAME} : {e}")
+            print(f"Erreur de parsing sur '{week_info}' dans la feuille {sheet_name} : {e}")
             continue
 
-        for col_index, cell in enumerate(row[1:], start=1):
-            if col_index - 1 < len(halfday_headers):
-                halfday_label = halfday_headers[col_index - 1]
-            else:
+        for col in range(MIN_COL + 1, MAX_COL + 1):
+            halfday_label = headers[col - MIN_COL]
+            if halfday_label is None:
                 continue
-            if (cell.value is None) and (cell.comment is None):
+            cellule = cellules[(row, col)]
+            if (cellule["valeur"] is None) and (cellule["commentaire"] is None):
                 continue
-            day_abbr = halfday_label.split()[0]
+            day_abbr = str(halfday_label).split()[0]
             offset = day_offsets.get(day_abbr, None)
             if offset is None:
                 continue
             event_date = monday_date + timedelta(days=offset)
             date_str = event_date.strftime("%Y-%m-%d")
-            subject = str(cell.value).strip() if cell.value else ""
-            description = cell.comment.text.strip() if cell.comment else ""
+            subject = str(cellule["valeur"]).strip() if cellule["valeur"] else ""
+            description = cellule["commentaire"].strip() if cellule["commentaire"] else ""
             # Récupération de la couleur pour déterminer la salle
-            location = ""
-            if cell.fill and cell.fill.fgColor and cell.fill.fgColor.rgb:
-                rgb = cell.fill.fgColor.rgb
-                if rgb.startswith("FF") and len(rgb) == 8:
-                    color_code = rgb[2:]
-                else:
-                    color_code = rgb
-                location = color_to_location.get(color_code, "")
-            events = split_subject_into_events(subject, date_str, halfday_label, location, description)
-            events_global.extend(events)
-    wb_orig.close()
-    
-    # Écriture du CSV final pour l'agenda
+            rgb = cellule["couleur"]
+            if rgb.startswith("FF") and len(rgb) == 8:
+                color_code = rgb[2:]
+            else:
+                color_code = rgb
+            location = color_to_location.get(color_code, "")
+            evenements_cellule = split_subject_into_events(subject, date_str, halfday_label, location, description)
+            events.extend(evenements_cellule)
+            if origines is not None:
+                origines.extend([(sheet_name, row, col)] * len(evenements_cellule))
+    return events
+
+def process_agenda(feuilles=None, version=None):
+    """
+    Traite les feuilles Excel pour générer le CSV (OUTPUT_CSV) contenant les événements, et l'export ICS (OUTPUT_ICS).
+    Par défaut, les grilles sont celles de la version courante du chargeur partagé (feuilles
+    de config.txt) ; une liste ou un motif de feuilles peut aussi être donné, elles sont alors
+    lues directement, en parallèle s'il y en a plusieurs. Les événements sont extraits de la grille
+    des cellules (valeurs, couleurs, commentaires, cellules fusionnées), étiquetés avec leur feuille
+    d'origine, puis synchronisés avec Google Calendar.
+    """
+    if feuilles is None:
+        # Version publiée : événements extraits et préparés une seule fois (evenements_version)
+        events_global, _, prep = evenements_version(version or CHARGEUR.actualiser())
+    else:
+        grilles = grilles_agenda(feuilles)
+        if not grilles:
+            return
+        events_global, _ = evenements_grilles(grilles)
+        prep = preparer_evenements(dataframe_evenements(events_global)) if events_global is not None else None
+    if events_global is None:
+        return
+    ecrire_csv_agenda(events_global)
+    if OUTPUT_ICS:
+        exporter_ics(prep)
+
+    # Synchronisation avec Google Calendar
+    service = service_agenda()
+    sync_events(service, prep=prep)
+
+def grilles_agenda(feuilles=None, version=None):
+    """Grilles des feuilles à traiter (voir process_agenda)."""
+    if feuilles is None:
+        return (version or CHARGEUR.actualiser()).grilles
+    if isinstance(feuilles, str):
+        return lire_grilles(resoudre_feuilles(feuilles))
+    return lire_grilles(resoudre_feuilles(",".join(feuilles)))
+
+_evenements_versions = {}
+_verrou_evenements_versions = threading.Lock()
+
+def evenements_version(version):
+    """
+    Événements d'une version publiée du classeur, extraits et préparés (preparer_evenements) une seule fois :
+    les deux dernières versions sont conservées, si bien que la version déjà synchronisée sert de base
+    à la synchronisation incrémentale suivante sans être extraite à nouveau.
+    Retourne (événements, origines, événements préparés), ou (None, None, None) sans en-têtes de demi-journées.
+    """
+    with _verrou_evenements_versions:
+        connue, resultat = _evenements_versions.get(version.numero, (None, None))
+    if connue is not version:
+        events, origines = evenements_grilles(version.grilles)
+        prep = preparer_evenements(dataframe_evenements(events)) if events is not None else None
+        resultat = (events, origines, prep)
+        with _verrou_evenements_versions:
+            _evenements_versions[version.numero] = (version, resultat)
+            for numero in sorted(_evenements_versions)[:-2]:
+                del _evenements_versions[numero]
+    return resultat
+
+def evenements_grilles(grilles):
+    """
+    Extrait les événements de toutes les grilles, étiquetés avec leur feuille d'origine.
+    Retourne (événements, origines), origines donnant la cellule source de chaque événement,
+    ou (None, None) si une feuille n'a pas d'en-têtes de demi-journées.
+    """
+    events_global, origines = [], []
+    for feuille, grille in grilles.items():
+        events = extraire_evenements(grille, feuille, origines)
+        if events is None:
+            return None, None
+        events_global.extend(ev + [feuille] for ev in events)
+    return events_global, origines
+
+def ecrire_csv_agenda(events, fichier=None):
+    """Écrit les événements au format du CSV de l'agenda (OUTPUT_CSV par défaut, ou un flux texte)."""
+    colonnes = ["Subject", "Date", "Start Time", "End Time", "Location", "Description", "Sheet"]
+    if fichier is not None:
+        writer = csv.writer(fichier, delimiter=';')
+        writer.writerow(colonnes)
+        writer.writerows(events)
+        return
     with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile, delimiter=';')
-        writer.writerow(["Subject", "Date", "Start Time", "End Time", "Location", "Description"])
-        for ev in events_global:
+        writer.writerow(colonnes)
+        for ev in events:
             writer.writerow(ev)
     print(f"✅ Fichier CSV généré pour l'agenda : {OUTPUT_CSV}")
-    
-    # Synchronisation avec Google Calendar
-    service = authenticate_google(TOKEN_PATH, CREDENTIALS_PATH)
-    df_agenda = pd.read_csv(OUTPUT_CSV, sep=';')
-    df_agenda.columns = df_agenda.columns.str.strip()
-    sync_events(service, df_agenda)
+
+def dataframe_evenements(events):
+    """
+    Construit le DataFrame des événements exactement comme s'il était relu depuis OUTPUT_CSV
+    (mêmes types et mêmes valeurs manquantes), sans passer par le disque.
+    """
+    tampon = StringIO()
+    ecrire_csv_agenda(events, tampon)
+    tampon.seek(0)
+    df = pd.read_csv(tampon, sep=';')
+    df.columns = df.columns.str.strip()
+    return df
+
+# -----------------------------------------------------------------------------
+# Export ICS (RFC 5545) : blocs VEVENT en cache, fichier écrit en flux
+# -----------------------------------------------------------------------------
+
+# Domaine des UID des événements ICS : "<csv_id>@<domaine>", csv_id étant la clé de sanitize_csv_id
+DOMAINE_UID_ICS = "agenda-sigma"
+
+def texte_ics(valeur):
+    """Échappe un texte pour une propriété ICS (antislash, point-virgule, virgule, retour à la ligne)."""
+    return (valeur.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def plier_ligne_ics(ligne):
+    """Plie une ligne ICS en lignes de 75 octets (UTF-8) au plus, sans couper de caractère ; terminée par CRLF."""
+    octets = ligne.encode("utf-8")
+    morceaux, debut, limite = [], 0, 75
+    while len(octets) - debut > limite:
+        fin = debut + limite
+        while (octets[fin] & 0xC0) == 0x80:  # Octet de suite d'un caractère multi-octets
+            fin -= 1
+        morceaux.append(octets[debut:fin])
+        debut, limite = fin, 74  # Les lignes de suite commencent par une espace
+    morceaux.append(octets[debut:])
+    return b"\r\n ".join(morceaux).decode("utf-8") + "\r\n"
+
+def horodatage_ics(horaire):
+    """Horaire canonique UTC ("2023-09-12T06:00:00+00:00") au format ICS ("20230912T060000Z")."""
+    return horaire[:19].replace("-", "").replace(":", "") + "Z"
+
+def bloc_vevent(evenement, sequence, dtstamp):
+    """Bloc VEVENT d'un événement préparé (ligne de preparer_evenements, via itertuples)."""
+    lignes = ["BEGIN:VEVENT", f"UID:{evenement.csv_id}@{DOMAINE_UID_ICS}", f"DTSTAMP:{dtstamp}", f"SEQUENCE:{sequence}",
+              f"DTSTART:{horodatage_ics(evenement.debut_utc)}", f"DTEND:{horodatage_ics(evenement.fin_utc)}",
+              f"SUMMARY:{texte_ics(evenement.summary)}"]
+    if evenement.location:
+        lignes.append(f"LOCATION:{texte_ics(evenement.location)}")
+    if evenement.description:
+        lignes.append(f"DESCRIPTION:{texte_ics(evenement.description)}")
+    lignes.append("END:VEVENT")
+    return "".join(plier_ligne_ics(ligne) for ligne in lignes)
+
+class CacheIcs:
+    """
+    Cache (SQLite) des blocs VEVENT du dernier export ICS : pour chaque UID, l'empreinte du contenu
+    (celle de preparer_evenements), SEQUENCE, DTSTAMP, le début (ordre du fichier) et le bloc déjà formaté.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vevents (
+            uid TEXT PRIMARY KEY,
+            empreinte TEXT NOT NULL,
+            sequence INTEGER NOT NULL,
+            dtstamp TEXT NOT NULL,
+            debut TEXT NOT NULL,
+            bloc TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, chemin):
+        self.connexion = sqlite3.connect(chemin)
+        self.connexion.executescript(self.SCHEMA)
+
+    def empreintes(self):
+        """Retourne {uid: (empreinte, sequence)}."""
+        return {uid: (empreinte, sequence) for uid, empreinte, sequence
+                in self.connexion.execute("SELECT uid, empreinte, sequence FROM vevents")}
+
+    def mettre_a_jour(self, blocs, uids_supprimes):
+        """Enregistre les blocs [(uid, empreinte, sequence, dtstamp, debut, bloc)] et oublie les UID supprimés."""
+        with self.connexion:
+            self.connexion.executemany("INSERT OR REPLACE INTO vevents VALUES (?, ?, ?, ?, ?, ?)", blocs)
+            self.connexion.executemany("DELETE FROM vevents WHERE uid = ?", [(uid,) for uid in uids_supprimes])
+
+    def blocs(self):
+        """Générateur des blocs VEVENT, par date de début."""
+        for (bloc,) in self.connexion.execute("SELECT bloc FROM vevents ORDER BY debut, uid"):
+            yield bloc
+
+    def fermer(self):
+        self.connexion.close()
+
+def exporter_ics(prep, fichier=None):
+    """
+    Exporte les événements préparés (preparer_evenements) au format ICS (OUTPUT_ICS par défaut).
+    Seuls les blocs VEVENT des événements nouveaux ou dont l'empreinte a changé sont générés, avec
+    SEQUENCE incrémenté et un nouveau DTSTAMP ; les autres sont repris du cache (<fichier>.cache).
+    Le fichier est écrit en flux depuis le cache dans un fichier temporaire qui remplace l'ancien,
+    et n'est pas réécrit si rien n'a changé. Retourne le nombre de blocs générés.
+    """
+    fichier = fichier or OUTPUT_ICS
+    cache = CacheIcs(fichier + ".cache")
+    try:
+        connus = cache.empreintes()
+        evenements = prep.drop_duplicates("csv_id")
+        uids = evenements["csv_id"] + "@" + DOMAINE_UID_ICS
+        modifies = evenements[uids.map(lambda uid: connus.get(uid, (None,))[0]) != evenements["empreinte"]]
+        uids_supprimes = set(connus).difference(uids)
+        if modifies.empty and not uids_supprimes and os.path.exists(fichier):
+            return 0
+        dtstamp = dt.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        blocs = []
+        for evenement in modifies.itertuples(index=False):
+            uid = f"{evenement.csv_id}@{DOMAINE_UID_ICS}"
+            sequence = connus[uid][1] + 1 if uid in connus else 0
+            blocs.append((uid, evenement.empreinte, sequence, dtstamp, evenement.debut_utc,
+                          bloc_vevent(evenement, sequence, dtstamp)))
+        cache.mettre_a_jour(blocs, uids_supprimes)
+
+        temporaire = fichier + ".tmp"
+        with open(temporaire, "w", encoding="utf-8", newline="") as f:
+            f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//CNUM//Agenda SIGMA//FR\r\nCALSCALE:GREGORIAN\r\n"
+                    f"X-WR-CALNAME:{texte_ics(PREFIXE_CALENDRIERS)}\r\nX-WR-TIMEZONE:{FUSEAU_AGENDA}\r\n")
+            for bloc in cache.blocs():
+                f.write(bloc)
+            f.write("END:VCALENDAR\r\n")
+        os.replace(temporaire, fichier)
+    finally:
+        cache.fermer()
+    print(f"✅ Fichier ICS généré pour l'agenda : {fichier} "
+          f"({len(blocs)} événement(s) régénéré(s), {len(uids_supprimes)} supprimé(s))")
+    return len(blocs)
 
 # =============================================================================
 # PARTIE 4 : SYNCHRONISATION AVEC GOOGLE CALENDAR
 # =============================================================================
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+TAILLE_LOT = int(config.get("taille_lot", 50))             # Requêtes par batch (50 au plus côté Google)
+LOTS_SIMULTANES = int(config.get("lots_simultanes", 4))    # Batchs envoyés en parallèle
+NB_ESSAIS = int(config.get("nb_essais", 5))                # Essais par requête en cas d'échec temporaire
+QPS_API = float(config.get("qps_api", 10))                 # Requêtes par seconde vers l'API (0 : pas de limite)
+BUDGET_JOURNALIER = int(config.get("budget_journalier", 1000000))  # Requêtes par jour (0 : pas de limite)
+HORIZON_PASSE_JOURS = int(config.get("horizon_passe_jours", 14))  # Au-delà, les événements passés sont figés
+CALENDRIERS = [genre.strip().lower() for genre in config.get("calendriers", "").split(",") if genre.strip()]  # feuille, salle, ue
+CALENDRIER_PRINCIPAL = config.get("calendrier_principal", "oui").lower() in ("oui", "true", "1")  # Tous les événements
+PREFIXE_CALENDRIERS = config.get("prefixe_calendriers", "Sigma")  # Nom des calendriers secondaires créés
+API_AGENDA = config.get("api_agenda", "")  # URL d'un serveur local remplaçant l'API (serveur_agenda_local.py)
+MARGE_RAFRAICHISSEMENT = 600  # Secondes avant l'expiration du jeton d'accès où il est renouvelé en arrière-plan
 
 def authenticate_google(token_path=TOKEN_PATH, credentials_path=CREDENTIALS_PATH):
     """
-    Authentifie l'utilisateur auprès de Google Calendar et retourne le service.
+    Authentifie l'utilisateur auprès de Google Calendar et retourne le service,
+    construit avec le document de découverte fourni avec googleapiclient (sans appel réseau).
     Si le token est expiré ou absent, le flux d'authentification est lancé.
+    Pour la synchronisation, utiliser plutôt le service partagé (service_agenda).
+    Si api_agenda est renseigné, le service pointe sans authentification sur ce serveur local
+    (serveur_agenda_local.py), qui fournit aussi le document de découverte.
     """
+    if API_AGENDA:
+        return build("calendar", "v3", http=httplib2.Http(), static_discovery=False,
+                     discoveryServiceUrl=API_AGENDA.rstrip("/") + "/discovery/v1/apis/{api}/{apiVersion}/rest")
     creds = None
     if os.path.exists(token_path):
         creds = Credentials.from_authorized_user_file(token_path, SCOPES)
@@ -458,9 +1719,49 @@ def authenticate_google(token_path=TOKEN_PATH, credentials_path=CREDENTIALS_PATH
         else:
             flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open(token_path, "w") as token:
-            token.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
+        enregistrer_jeton(creds, token_path)
+    return build("calendar", "v3", credentials=creds, static_discovery=True, cache_discovery=False)
+
+def enregistrer_jeton(creds, token_path=TOKEN_PATH):
+    """Écrit les identifiants dans token.json (fichier temporaire puis remplacement, jamais à moitié écrit)."""
+    temporaire = token_path + ".tmp"
+    with open(temporaire, "w") as token:
+        token.write(creds.to_json())
+    os.replace(temporaire, token_path)
+
+def rafraichir_identifiants(creds, token_path=TOKEN_PATH):
+    """
+    Renouvelle le jeton d'accès MARGE_RAFRAICHISSEMENT secondes avant son expiration (thread d'arrière-plan),
+    pour qu'aucune requête n'ait à attendre un rafraîchissement ; token.json est réécrit à chaque renouvellement.
+    """
+    while creds.refresh_token and creds.expiry is not None:
+        restant = (creds.expiry - dt.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+        time.sleep(max(restant - MARGE_RAFRAICHISSEMENT, 0))
+        try:
+            creds.refresh(Request())
+            enregistrer_jeton(creds, token_path)
+        except Exception as e:
+            print(f"[Agenda] Rafraîchissement des identifiants impossible : {e}")
+            time.sleep(60)
+
+_service_agenda = None
+_verrou_service_agenda = threading.Lock()
+
+def service_agenda():
+    """
+    Retourne le service Google Calendar partagé par tous les cycles et tous les threads, construit au premier appel
+    (authenticate_google) ; ses identifiants sont ensuite renouvelés en arrière-plan (rafraichir_identifiants).
+    Les requêtes sont exécutées sur des connexions persistantes prêtées par connexion_service.
+    """
+    global _service_agenda
+    with _verrou_service_agenda:
+        if _service_agenda is None:
+            _service_agenda = authenticate_google(TOKEN_PATH, CREDENTIALS_PATH)
+            http = getattr(_service_agenda, "_http", None)
+            if isinstance(http, AuthorizedHttp):
+                threading.Thread(target=rafraichir_identifiants, args=(http.credentials, TOKEN_PATH),
+                                 name="IdentifiantsThread", daemon=True).start()
+        return _service_agenda
 
 def convert_to_datetime(date_str, time_str):
     """
@@ -469,100 +1770,1069 @@ def convert_to_datetime(date_str, time_str):
     datetime_str = f"{date_str} {time_str}"
     return dt.strptime(datetime_str, "%Y-%m-%d %H:%M")
 
+# Caractères retirés des identifiants csv_id (règle commune à sanitize_csv_id et sanitize_csv_ids)
+RE_CARACTERES_CSV_ID = re.compile(r"[^a-z0-9_]")
+
 def sanitize_csv_id(input_str):
     """
     Génère un identifiant unique en conservant uniquement les caractères alphanumériques en minuscules et le caractère '_'.
     On combine plusieurs champs (Date, Start Time, Subject, Location) pour obtenir un identifiant stable.
     """
-    allowed = set("abcdefghijklmnopqrstuvwxyz0123456789_")
-    result = input_str.replace(" ", "_").lower()
-    return ''.join(c for c in result if c in allowed)
-
-def fetch_existing_events(service):
-    """
-    Récupère les événements existants dans le calendrier, indexés par leur csv_id.
-    """
-    events_result = service.events().list(
-        calendarId='primary',
-        maxResults=1000,
-        singleEvents=True
-    ).execute()
-    existing_events = {}
-    for event in events_result.get('items', []):
-        csv_id = event.get('extendedProperties', {}).get('private', {}).get('csv_id')
-        if csv_id:
-            existing_events[csv_id] = event
-    return existing_events
-
-def sync_events(service, df):
-    """
-    Synchronise les événements du CSV avec Google Calendar :
-    création, mise à jour et suppression en batch.
-    L'identifiant unique (csv_id) est généré à partir de Date, Start Time, Subject et Location.
-    La couleur (colorId) est attribuée en fonction de la salle (avec une valeur par défaut de 5).
-    """
-    room_colors = {
-        "Salle UT2J sans ordi": 11,
-        "UT2J GS027": 6,
-        "UT2J GS021": 5,
-        "1003-Langue": 7,
-        "Salle ENSAT sans ordi": 10,
-        "703 (projet) ou alternance (entreprise)": 2,
-        "UT2J GS028": 4,
+    return RE_CARACTERES_CSV_ID.sub("", input_str.replace(" ", "_").lower())
+
+def sanitize_csv_ids(serie):
+    """Version vectorisée de sanitize_csv_id, sur une Series pandas de chaînes."""
+    return serie.str.replace(" ", "_", regex=False).str.lower().str.replace(RE_CARACTERES_CSV_ID, "", regex=True)
+
+class EtatAgenda:
+    """
+    État local et persistant (SQLite) des événements synchronisés, par calendrier :
+    pour chaque csv_id, l'id de l'événement Google, son etag, l'empreinte et la forme canonique
+    du dernier contenu envoyé, son début (UTC) et la date de la dernière synchronisation, ainsi que le jeton de synchronisation
+    (nextSyncToken) du dernier listage, et l'id des calendriers secondaires créés (par feuille, salle ou UE).
+    La planification des créations, mises à jour et suppressions se fait sur cet état,
+    sans appel réseau ; le listage distant ne sert qu'à le réconcilier.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS evenements (
+            calendrier TEXT NOT NULL,
+            csv_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            etag TEXT,
+            empreinte TEXT,
+            derniere_synchro TEXT,
+            contenu TEXT,
+            debut TEXT,
+            PRIMARY KEY (calendrier, csv_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_evenements_event_id ON evenements (calendrier, event_id);
+        CREATE TABLE IF NOT EXISTS jetons (
+            calendrier TEXT PRIMARY KEY,
+            sync_token TEXT
+        );
+        CREATE TABLE IF NOT EXISTS calendriers (
+            partition TEXT PRIMARY KEY,
+            calendar_id TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self.verrou = threading.Lock()
+        self.connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        self.connexion.executescript(self.SCHEMA)
+
+    def evenements(self, calendrier='primary'):
+        """Retourne {csv_id: (event_id, etag, empreinte, contenu, debut)} pour le calendrier."""
+        with self.verrou:
+            lignes = self.connexion.execute(
+                "SELECT csv_id, event_id, etag, empreinte, contenu, debut FROM evenements WHERE calendrier = ?",
+                (calendrier,))
+            return {ligne[0]: ligne[1:] for ligne in lignes}
+
+    def enregistrer(self, calendrier, csv_id, event, empreinte, contenu=None):
+        """Enregistre l'événement retourné par l'API, et l'empreinte et la forme canonique du contenu envoyé."""
+        debut = json.loads(contenu)["start"] if contenu else None
+        with self.verrou, self.connexion:
+            self.connexion.execute(
+                "INSERT OR REPLACE INTO evenements (calendrier, csv_id, event_id, etag, empreinte, derniere_synchro,"
+                " contenu, debut) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (calendrier, csv_id, event["id"], event.get("etag"), empreinte, dt.now().isoformat(timespec="seconds"),
+                 contenu, debut))
+
+    def supprimer(self, calendrier, csv_id):
+        with self.verrou, self.connexion:
+            self.connexion.execute("DELETE FROM evenements WHERE calendrier = ? AND csv_id = ?", (calendrier, csv_id))
+
+    def jeton(self, calendrier='primary'):
+        with self.verrou:
+            ligne = self.connexion.execute(
+                "SELECT sync_token FROM jetons WHERE calendrier = ?", (calendrier,)).fetchone()
+            return ligne[0] if ligne else None
+
+    def calendrier(self, partition):
+        """Retourne l'id du calendrier secondaire d'une partition ("salle:UT2J GS027"...), ou None."""
+        with self.verrou:
+            ligne = self.connexion.execute(
+                "SELECT calendar_id FROM calendriers WHERE partition = ?", (partition,)).fetchone()
+            return ligne[0] if ligne else None
+
+    def partitions(self):
+        with self.verrou:
+            return [ligne[0] for ligne in self.connexion.execute("SELECT partition FROM calendriers")]
+
+    def definir_calendrier(self, partition, calendar_id):
+        with self.verrou, self.connexion:
+            self.connexion.execute(
+                "INSERT OR REPLACE INTO calendriers (partition, calendar_id) VALUES (?, ?)", (partition, calendar_id))
+
+    def oublier_calendrier(self, partition):
+        """Oublie un calendrier secondaire (supprimé dans Google), ses événements et son jeton."""
+        calendar_id = self.calendrier(partition)
+        with self.verrou, self.connexion:
+            self.connexion.execute("DELETE FROM calendriers WHERE partition = ?", (partition,))
+            self.connexion.execute("DELETE FROM evenements WHERE calendrier = ?", (calendar_id,))
+            self.connexion.execute("DELETE FROM jetons WHERE calendrier = ?", (calendar_id,))
+
+    def reconcilier(self, calendrier, evenements_modifies, ids_supprimes, sync_token, complet=False,
+                    time_min=None, time_max=None):
+        """
+        Applique le résultat d'un listage distant en une seule transaction :
+        - evenements_modifies : événements (avec csv_id) présents dans le calendrier ;
+        - ids_supprimes : ids des événements supprimés (status "cancelled") ;
+        - complet : le listage est complet (entre time_min et time_max s'ils sont donnés, au format UTC
+          canonique), les événements de cette période qui n'y figurent pas sont oubliés.
+        Un événement dont l'etag n'a pas changé garde l'empreinte et le contenu du dernier envoi ;
+        sinon (modification extérieure, ou état local vide), l'empreinte canonique de son contenu distant
+        est enregistrée : elle est égale à celle du corps local tant que le contenu n'a pas changé.
+        """
+        maintenant = dt.now().isoformat(timespec="seconds")
+        with self.verrou, self.connexion:
+            connus = {
+                ligne[1]: (ligne[0],) + ligne[2:] for ligne in self.connexion.execute(
+                    "SELECT csv_id, event_id, etag, empreinte, contenu FROM evenements WHERE calendrier = ?",
+                    (calendrier,))}
+            if complet:
+                self.connexion.execute(
+                    "DELETE FROM evenements WHERE calendrier = ? AND (debut IS NULL OR"
+                    " ((? IS NULL OR debut >= ?) AND (? IS NULL OR debut < ?)))",
+                    (calendrier, time_min, time_min, time_max, time_max))
+            self.connexion.executemany(
+                "DELETE FROM evenements WHERE calendrier = ? AND event_id = ?",
+                [(calendrier, event_id) for event_id in ids_supprimes])
+            lignes = []
+            for event in evenements_modifies:
+                csv_id = event["extendedProperties"]["private"]["csv_id"]
+                connu = connus.get(event["id"])
+                if connu is not None and connu[0] == csv_id and connu[1] == event.get("etag"):
+                    empreinte, contenu = connu[2], connu[3]
+                else:
+                    contenu = contenu_canonique(event)
+                    empreinte = empreinte_evenement(event)
+                lignes.append((calendrier, csv_id, event["id"], event.get("etag"), empreinte, maintenant, contenu,
+                               horaire_canonique(event.get("start", {}))))
+            self.connexion.executemany(
+                "INSERT OR REPLACE INTO evenements (calendrier, csv_id, event_id, etag, empreinte, derniere_synchro,"
+                " contenu, debut) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", lignes)
+            self.connexion.execute(
+                "INSERT OR REPLACE INTO jetons (calendrier, sync_token) VALUES (?, ?)", (calendrier, sync_token))
+
+_etat_agenda = None
+_verrou_etat_agenda = threading.Lock()
+
+def etat_agenda():
+    """Retourne l'état local des événements synchronisés (ouvert au premier appel et conservé ensuite)."""
+    global _etat_agenda
+    with _verrou_etat_agenda:
+        if _etat_agenda is None:
+            _etat_agenda = EtatAgenda(ETAT_AGENDA)
+        return _etat_agenda
+
+def parcourir_evenements(service, calendar_id='primary', sync_token=None, fin_listage=None, time_min=None, time_max=None):
+    """
+    Générateur parcourant les événements du calendrier page par page (nextPageToken).
+    Sans sync_token, tous les événements sont listés (seulement ceux de la période time_min - time_max
+    si elle est donnée) ; avec un sync_token, seuls les événements modifiés ou supprimés
+    (status "cancelled") depuis ce jeton sont retournés (Google n'accepte alors pas de période).
+    Une fois la dernière page atteinte, le nouveau jeton (nextSyncToken) est transmis à fin_listage.
+    Lève HttpError (410) si le jeton n'est plus valide.
+    """
+    page_token = None
+    while True:
+        parametres = {"calendarId": calendar_id, "maxResults": 2500, "singleEvents": True}
+        if sync_token:
+            parametres["syncToken"] = sync_token
+        else:
+            if time_min:
+                parametres["timeMin"] = time_min
+            if time_max:
+                parametres["timeMax"] = time_max
+        if page_token:
+            parametres["pageToken"] = page_token
+        LIMITEUR.acquerir()
+        with connexion_service(service) as http:
+            events_result = service.events().list(**parametres).execute(http=http, num_retries=NB_ESSAIS - 1)
+        yield from events_result.get('items', [])
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            if fin_listage is not None:
+                fin_listage(events_result.get('nextSyncToken'))
+            return
+
+def fetch_existing_events(service, calendar_id='primary', sync_token=None, time_min=None, time_max=None):
+    """
+    Récupère les événements du calendrier portant un csv_id, ainsi que les ids des événements supprimés
+    (listage incrémental uniquement) et le nouveau jeton de synchronisation.
+    Retourne (événements, ids supprimés, jeton).
+    """
+    derniers, jetons = {}, []
+    for event in parcourir_evenements(service, calendar_id, sync_token, jetons.append, time_min, time_max):
+        # Seul le dernier état de chaque événement compte ; les événements supprimés ne portent plus que leur id
+        derniers[event['id']] = None if event.get('status') == 'cancelled' else event
+    existing_events = [event for event in derniers.values()
+                       if event is not None and event.get('extendedProperties', {}).get('private', {}).get('csv_id')]
+    ids_supprimes = [event_id for event_id, event in derniers.items() if event is None]
+    return existing_events, ids_supprimes, jetons[0]
+
+def dedoublonner_evenements(service, etat, calendar_id, evenements, supprimer=True):
+    """
+    Ne garde qu'un événement par csv_id : celui qui porte l'id déterministe (identifiant_evenement),
+    sinon celui de l'état local, sinon le premier listé. Les doublons (créations renvoyées avant les
+    ids déterministes) sont supprimés du calendrier si supprimer est vrai.
+    Retourne les événements conservés.
+    """
+    par_csv_id = {}
+    for event in evenements:
+        par_csv_id.setdefault(event["extendedProperties"]["private"]["csv_id"], []).append(event)
+    if all(len(groupe) == 1 for groupe in par_csv_id.values()):
+        return evenements
+    connus = etat.evenements(calendar_id)
+    conserves, doublons = [], []
+    for csv_id, groupe in par_csv_id.items():
+        preferes = (identifiant_evenement(csv_id), connus[csv_id][0] if csv_id in connus else None)
+        groupe.sort(key=lambda event: (event["id"] != preferes[0], event["id"] != preferes[1]))
+        conserves.append(groupe[0])
+        doublons += [event["id"] for event in groupe[1:]]
+    if supprimer:
+        print(f"[Agenda] Suppression de {len(doublons)} doublon(s)")
+        evenements_api = service.events()
+        def signaler(event_id, response, exception):
+            if exception is not None:
+                print(f"[Agenda] Échec de la suppression du doublon {event_id} : {exception}")
+        ExecuteurLots(service, TAILLE_LOT, LOTS_SIMULTANES, NB_ESSAIS).executer(
+            [(event_id, evenements_api.delete(calendarId=calendar_id, eventId=event_id)) for event_id in doublons],
+            signaler)
+    return conserves
+
+def reconcilier_agenda(service, etat, calendar_id='primary', time_min=None, time_max=None, dedoublonner=True):
+    """
+    Réconcilie l'état local avec le calendrier : seuls les changements depuis le dernier jeton
+    de synchronisation sont téléchargés ; sans jeton, ou si Google l'a invalidé (410 Gone),
+    le calendrier est listé entièrement sur la période time_min - time_max (horizon de synchronisation)
+    et remplace l'état local de cette période. Les doublons trouvés par un listage complet
+    sont supprimés du calendrier (dedoublonner), ou seulement écartés de l'état local.
+    """
+    sync_token = etat.jeton(calendar_id)
+    if sync_token:
+        try:
+            evenements, ids_supprimes, jeton = fetch_existing_events(service, calendar_id, sync_token)
+            etat.reconcilier(calendar_id, evenements, ids_supprimes, jeton)
+            return
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            print("[Agenda] Jeton de synchronisation expiré : listage complet du calendrier")
+    evenements, _, jeton = fetch_existing_events(service, calendar_id, time_min=time_min, time_max=time_max)
+    evenements = dedoublonner_evenements(service, etat, calendar_id, evenements, supprimer=dedoublonner)
+    etat.reconcilier(calendar_id, evenements, [], jeton, complet=True, time_min=time_min, time_max=time_max)
+
+# Couleur (colorId) de l'événement en fonction de la salle
+ROOM_COLORS = {
+    "Salle UT2J sans ordi": 11,
+    "UT2J GS027": 6,
+    "UT2J GS021": 5,
+    "1003-Langue": 7,
+    "Salle ENSAT sans ordi": 10,
+    "703 (projet) ou alternance (entreprise)": 2,
+    "UT2J GS028": 4,
+}
+
+FUSEAU_AGENDA = "Europe/Paris"
+
+def texte_canonique(valeur):
+    """Valeur textuelle canonique d'un champ : les valeurs manquantes (None, NaN de pandas) deviennent ''."""
+    if valeur is None or (not isinstance(valeur, str) and pd.isna(valeur)):
+        return ""
+    return str(valeur)
+
+def horaire_canonique(moment):
+    """
+    Horaire canonique ({"dateTime", "timeZone"} ou {"date"}) : instant converti en UTC, pour que
+    "2024-03-04T08:30:00" (Europe/Paris) et "2024-03-04T08:30:00+01:00" ou "...07:30:00Z" soient égaux.
+    """
+    if "dateTime" not in moment:
+        return texte_canonique(moment.get("date"))
+    instant = datetime.fromisoformat(moment["dateTime"].replace("Z", "+00:00"))
+    if instant.tzinfo is None:
+        instant = instant.replace(tzinfo=ZoneInfo(moment.get("timeZone") or FUSEAU_AGENDA))
+    return instant.astimezone(timezone.utc).isoformat()
+
+def normaliser_evenement(event):
+    """
+    Forme canonique du contenu synchronisé d'un événement (titre, salle, description, horaires, couleur),
+    identique pour un corps construit localement et pour l'événement retourné par l'API
+    (valeurs manquantes, colorId entier ou texte, décalages horaires).
+    """
+    return {
+        "summary": texte_canonique(event.get("summary")),
+        "location": texte_canonique(event.get("location")),
+        "description": texte_canonique(event.get("description")),
+        "start": horaire_canonique(event.get("start", {})),
+        "end": horaire_canonique(event.get("end", {})),
+        "colorId": texte_canonique(event.get("colorId")),
+    }
+
+def contenu_canonique(event):
+    """Forme canonique du contenu d'un événement, sérialisée en JSON (conservée dans l'état local)."""
+    return json.dumps(normaliser_evenement(event), sort_keys=True, ensure_ascii=False)
+
+def empreinte_evenement(event):
+    """Empreinte (SHA-1) de la forme canonique du contenu d'un événement."""
+    return hashlib.sha1(contenu_canonique(event).encode("utf-8")).hexdigest()
+
+def champs_modifies(contenu_connu, event_body):
+    """
+    Champs du corps (summary, location, description, start, end, colorId) dont la forme canonique
+    diffère du dernier contenu envoyé, ou None si ce contenu n'est pas connu.
+    """
+    if contenu_connu is None:
+        return None
+    ancien = json.loads(contenu_connu)
+    nouveau = normaliser_evenement(event_body)
+    return [champ for champ, valeur in nouveau.items() if ancien.get(champ) != valeur]
+
+def planifier_evenement(csv_id, event_body, connu, events_to_create, events_to_update):
+    """
+    Ajoute l'opération nécessaire pour un événement d'après son état connu (ou None) :
+    création, modification des seuls champs changés, ou rien si son empreinte n'a pas changé.
+    """
+    empreinte = event_body["extendedProperties"]["private"]["empreinte"]
+    if connu is None:
+        events_to_create.append((csv_id, event_body, empreinte))
+    elif connu[2] != empreinte:
+        event_body['id'] = connu[0]
+        events_to_update.append((csv_id, connu[0], event_body, empreinte, champs_modifies(connu[3], event_body)))
+
+def textes_canoniques(colonne):
+    """Version vectorisée de texte_canonique pour une colonne."""
+    return colonne.astype(object).where(colonne.notna(), "").map(str)
+
+def preparer_evenements(df):
+    """
+    Prépare en une seule passe vectorisée les événements du CSV de l'agenda : csv_id (Date, Start Time,
+    Subject et Location, filtrés par sanitize_csv_ids), horaires (locaux et UTC), couleur de la salle
+    (ROOM_COLORS, 5 par défaut), forme canonique du contenu et empreinte. Une ligne par ligne du CSV, même index.
+    """
+    date, debut, fin = (df[colonne].map(str) for colonne in ("Date", "Start Time", "End Time"))
+    brut = date + "_" + debut + "_" + df["Subject"].map(str) + "_" + df["Location"].map(str)
+    csv_id = sanitize_csv_ids(brut)
+    location = textes_canoniques(df["Location"])
+    prep = pd.DataFrame({
+        "csv_id": csv_id,
+        "summary": textes_canoniques(df["Subject"]),
+        "location": location,
+        "description": textes_canoniques(df["Description"]),
+        "debut": date + "T" + debut + ":00",
+        "fin": date + "T" + fin + ":00",
+        "colorId": location.map(ROOM_COLORS).fillna(5).astype(int).astype(str),
+    }, index=df.index)
+    # Horaires canoniques (UTC), comme horaire_canonique ; la conversion valide aussi les dates et heures
+    debut_utc, fin_utc = (
+        pd.Series(np.datetime_as_string(
+            pd.to_datetime(date + " " + heure, format="%Y-%m-%d %H:%M")
+            .dt.tz_localize(FUSEAU_AGENDA, ambiguous=True, nonexistent="shift_forward")
+            .dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(), unit="s"), index=df.index) + "+00:00"
+        for heure in (debut, fin))
+    prep["debut_utc"], prep["fin_utc"] = debut_utc, fin_utc
+    if "Sheet" in df:
+        prep["feuille"] = df["Sheet"]
+    # Même texte que contenu_canonique : json.dumps(..., sort_keys=True, ensure_ascii=False)
+    texte_json = json.encoder.encode_basestring
+    prep["contenu"] = [
+        f'{{"colorId": {color_id}, "description": {description}, "end": {end}, '
+        f'"location": {location}, "start": {start}, "summary": {summary}}}'
+        for color_id, description, end, location, start, summary in zip(
+            *(colonne.map(texte_json).tolist() for colonne in (
+                prep["colorId"], prep["description"], fin_utc, prep["location"], debut_utc, prep["summary"])))]
+    prep["empreinte"] = [hashlib.sha1(contenu.encode("utf-8")).hexdigest() for contenu in prep["contenu"].tolist()]
+    return prep
+
+def corps_evenement(evenement):
+    """Corps Google Calendar d'un événement préparé (ligne de preparer_evenements, via itertuples)."""
+    return {
+        "summary": evenement.summary,
+        "location": evenement.location,
+        "description": evenement.description,
+        "start": {"dateTime": evenement.debut, "timeZone": FUSEAU_AGENDA},
+        "end": {"dateTime": evenement.fin, "timeZone": FUSEAU_AGENDA},
+        "colorId": evenement.colorId,
+        "extendedProperties": {"private": {"csv_id": evenement.csv_id, "empreinte": evenement.empreinte}},
     }
-    existing_events = fetch_existing_events(service)
+
+def identifiant_evenement(csv_id):
+    """
+    Id Google déterministe d'un événement, dérivé de son csv_id (base32hex en minuscules : caractères
+    0-9 et a-v acceptés par l'API). Une création renvoyée après un échec temporaire alors qu'elle avait
+    abouti est refusée (409) au lieu de créer un doublon.
+    """
+    return base64.b32hexencode(hashlib.sha1(csv_id.encode("utf-8")).digest()).decode("ascii").rstrip("=").lower()
+
+def debut_horizon():
+    """
+    Début de l'horizon de synchronisation (UTC, format canonique) : les événements commençant avant
+    (plus de HORIZON_PASSE_JOURS jours dans le passé) sont figés, ni listés, ni modifiés, ni supprimés.
+    """
+    debut = dt.now(timezone.utc) - timedelta(days=HORIZON_PASSE_JOURS)
+    return debut.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+def planifier_synchro(prep, etat, calendar_id='primary', horizon=None):
+    """
+    Planifie la synchronisation des événements préparés (preparer_evenements) à partir de l'état local
+    uniquement (sans appel réseau). Les empreintes sont comparées sur les colonnes préparées ;
+    seuls les événements nouveaux ou modifiés sont construits. Les événements commençant avant
+    horizon (début de l'horizon de synchronisation) sont figés.
+    Retourne les listes (csv_id, corps, empreinte) à créer, (csv_id, event_id, corps, empreinte, champs)
+    à mettre à jour (champs : champs modifiés, ou None pour envoyer le corps complet)
+    et (csv_id, event_id) à supprimer.
+    """
+    connus = etat.evenements(calendar_id)
+    # Un même cours peut figurer sur plusieurs feuilles (cours commun M1/M2) : un seul événement
+    a_jour = prep.drop_duplicates("csv_id")
+    if horizon:
+        a_jour = a_jour[a_jour["debut_utc"] >= horizon]
+    empreintes_connues = a_jour["csv_id"].map({csv_id: connu[2] for csv_id, connu in connus.items()})
     events_to_create = []
     events_to_update = []
-    events_to_delete = []
-    for _, row in df.iterrows():
-        # Génération stable du csv_id en combinant Date, Start Time, Subject et Location
-        raw_id = f"{row['Date']}_{row['Start Time']}_{row['Subject']}_{row['Location']}"
-        csv_id = sanitize_csv_id(raw_id)
-        start_datetime = convert_to_datetime(row['Date'], row['Start Time'])
-        end_datetime = convert_to_datetime(row['Date'], row['End Time'])
-        location = row['Location']
-        color_id = room_colors.get(location, 5)  # Couleur par défaut si la salle n'est pas référencée
-        event_body = {
-            "summary": row["Subject"],
-            "location": location,
-            "description": row["Description"],
-            "start": {"dateTime": start_datetime.isoformat(), "timeZone": "Europe/Paris"},
-            "end": {"dateTime": end_datetime.isoformat(), "timeZone": "Europe/Paris"},
-            "extendedProperties": {"private": {"csv_id": csv_id}},
-            "colorId": color_id,
-        }
-        if csv_id in existing_events:
-            existing_event = existing_events[csv_id]
-            differences = []
-            if existing_event.get('summary', '') != row['Subject']:
-                differences.append('summary')
-            if existing_event.get('location', '') != location:
-                differences.append('location')
-            if existing_event.get('description', '') != row['Description']:
-                differences.append('description')
-            if existing_event.get('start', {}).get('dateTime', '') != start_datetime.isoformat():
-                differences.append('start time')
-            if existing_event.get('end', {}).get('dateTime', '') != end_datetime.isoformat():
-                differences.append('end time')
-            if differences:
-                event_body['id'] = existing_event['id']
-                events_to_update.append(event_body)
+    for evenement in a_jour[empreintes_connues != a_jour["empreinte"]].itertuples(index=False):
+        planifier_evenement(evenement.csv_id, corps_evenement(evenement), connus.get(evenement.csv_id),
+                            events_to_create, events_to_update)
+    events_to_delete = [
+        (csv_id, connus[csv_id][0]) for csv_id in set(connus).difference(prep["csv_id"])
+        if not horizon or connus[csv_id][4] is None or connus[csv_id][4] >= horizon]
+    return events_to_create, events_to_update, events_to_delete
+
+class LimiteurDebit:
+    """
+    Limiteur de débit (seau à jetons) partagé par tous les appels à l'API Google Calendar :
+    au plus qps requêtes par seconde en moyenne et budget_journalier requêtes par jour
+    (0 : pas de limite). Les demandes en attente sont servies par priorité croissante
+    (les événements les plus proches d'abord, voir priorite_csv_id).
+    """
+
+    def __init__(self, qps, budget_journalier):
+        self.qps = qps
+        self.capacite = max(1.0, qps)
+        self.budget_journalier = budget_journalier
+        self.jetons = self.capacite
+        self.dernier_remplissage = time.monotonic()
+        self.jour = dt.now().date()
+        self.requetes_jour = 0
+        self.file = []
+        self.compteur = itertools.count()
+        self.condition = threading.Condition()
+
+    def _remplir(self):
+        maintenant = time.monotonic()
+        self.jetons = min(self.capacite, self.jetons + (maintenant - self.dernier_remplissage) * self.qps)
+        self.dernier_remplissage = maintenant
+        if dt.now().date() != self.jour:
+            self.jour = dt.now().date()
+            self.requetes_jour = 0
+
+    def acquerir(self, n=1, priorite=0.0):
+        """
+        Attend que n requêtes puissent être envoyées, après les demandes plus prioritaires.
+        Une demande de plus de jetons que la capacité du seau l'attend plein et le laisse en dette.
+        Lève RuntimeError si le budget journalier est épuisé.
+        """
+        with self.condition:
+            ticket = (priorite, next(self.compteur))
+            heapq.heappush(self.file, ticket)
+            try:
+                while True:
+                    self._remplir()
+                    if self.budget_journalier and self.requetes_jour + n > self.budget_journalier:
+                        raise RuntimeError(f"Quota journalier épuisé ({self.requetes_jour}/{self.budget_journalier} requêtes)")
+                    if self.file[0] != ticket:
+                        self.condition.wait()
+                    elif self.qps > 0 and self.jetons < min(n, self.capacite):
+                        self.condition.wait((min(n, self.capacite) - self.jetons) / self.qps)
+                    else:
+                        break
+                self.jetons -= n
+                self.requetes_jour += n
+            finally:
+                self.file.remove(ticket)
+                heapq.heapify(self.file)
+                self.condition.notify_all()
+
+    def usage(self):
+        """Utilisation actuelle du quota."""
+        with self.condition:
+            self._remplir()
+            return {
+                "qps": self.qps,
+                "jetons": round(self.jetons, 2),
+                "requetes_jour": self.requetes_jour,
+                "budget_journalier": self.budget_journalier,
+                "restant": self.budget_journalier - self.requetes_jour if self.budget_journalier else None,
+                "en_attente": len(self.file),
+            }
+
+LIMITEUR = LimiteurDebit(QPS_API, BUDGET_JOURNALIER)
+
+def priorite_csv_id(csv_id):
+    """
+    Priorité d'envoi d'une opération d'après la date de l'événement, lue dans son csv_id
+    ("AAAAMMJJ_HHMM_...") : les événements à venir les plus proches d'abord, puis les événements passés.
+    """
+    try:
+        debut = dt.strptime(csv_id[:13], "%Y%m%d_%H%M")
+    except ValueError:
+        return float("inf")
+    ecart = (debut - dt.now()).total_seconds()
+    return ecart if ecart >= 0 else 1e10 - ecart
+
+def connexion_http(service):
+    """
+    Nouvelle connexion HTTP authentifiée avec les identifiants du service
+    (httplib2 n'étant pas thread-safe, une connexion ne sert qu'à un thread à la fois),
+    sans authentification pour un serveur local (api_agenda).
+    Retourne None si le service n'expose pas sa connexion.
+    """
+    http = getattr(service, "_http", None)
+    if http is None:
+        return None
+    if not isinstance(http, AuthorizedHttp):
+        return httplib2.Http()
+    return AuthorizedHttp(http.credentials, http=httplib2.Http())
+
+_connexions_libres = weakref.WeakKeyDictionary()
+_verrou_connexions = threading.Lock()
+
+@contextmanager
+def connexion_service(service):
+    """
+    Prête une connexion HTTP du service (créée par connexion_http s'il n'y en a pas de libre) à un seul thread.
+    Rendue après usage, elle garde sa connexion TCP/TLS ouverte (keep-alive) pour les requêtes suivantes,
+    y compris celles des cycles de synchronisation suivants.
+    """
+    with _verrou_connexions:
+        libres = _connexions_libres.setdefault(service, [])
+        http = libres.pop() if libres else None
+    if http is None:
+        http = connexion_http(service)
+    try:
+        yield http
+    finally:
+        with _verrou_connexions:
+            libres.append(http)
+
+def erreur_temporaire(exception):
+    """Indique si une requête en échec peut être renvoyée (limite de débit, erreur serveur ou réseau)."""
+    if isinstance(exception, HttpError):
+        statut = exception.resp.status
+        if statut == 403:
+            return b"ratelimitexceeded" in (exception.content or b"").lower()
+        return statut in (429, 500, 502, 503, 504)
+    return isinstance(exception, (OSError, httplib2.HttpLib2Error))
+
+class ExecuteurLots:
+    """
+    Envoi des requêtes d'écriture par lots (batch) de taille_lot requêtes au plus,
+    avec nb_lots_simultanes lots envoyés en parallèle.
+    Le résultat de chaque requête est transmis une seule fois à callback(request_id, response, exception) :
+    les requêtes en échec temporaire (403/429 de limite de débit, 5xx, erreur réseau) sont renvoyées
+    jusqu'à nb_essais fois, après une attente exponentielle avec gigue (full jitter).
+    Chaque lot passe par le limiteur de débit (LIMITEUR), avec la priorité de sa requête
+    la plus prioritaire selon la fonction priorite(request_id).
+    """
+
+    def __init__(self, service, taille_lot=50, nb_lots_simultanes=4, nb_essais=5, delai_base=1.0, delai_max=32.0,
+                 priorite=None):
+        self.service = service
+        self.priorite = priorite or (lambda request_id: 0.0)
+        self.taille_lot = taille_lot
+        self.nb_lots_simultanes = nb_lots_simultanes
+        self.nb_essais = nb_essais
+        self.delai_base = delai_base
+        self.delai_max = delai_max
+
+    def _executer_lot(self, lot):
+        """Envoie un lot ; retourne {request_id: (response, exception)}."""
+        resultats = {}
+        def enregistrer(request_id, response, exception):
+            resultats[request_id] = (response, exception)
+        batch = self.service.new_batch_http_request(callback=enregistrer)
+        for request_id, requete in lot:
+            batch.add(requete, request_id=request_id)
+        try:
+            LIMITEUR.acquerir(len(lot), min(self.priorite(request_id) for request_id, _ in lot))
+            with connexion_service(self.service) as http:
+                batch.execute(http=http)
+        except Exception as e:
+            # Échec du lot entier : toutes ses requêtes sans réponse partagent l'erreur
+            for request_id, _ in lot:
+                resultats.setdefault(request_id, (None, e))
+        return resultats
+
+    def executer(self, requetes, callback):
+        """
+        Exécute les requêtes [(request_id, requête HTTP)], les request_id étant uniques,
+        les plus prioritaires en premier.
+        Retourne le nombre de requêtes restées en échec.
+        """
+        en_attente = sorted(requetes, key=lambda requete: self.priorite(requete[0]))
+        nb_echecs = 0
+        with ThreadPoolExecutor(max_workers=self.nb_lots_simultanes) as pool:
+            for essai in range(self.nb_essais):
+                if not en_attente:
+                    break
+                if essai:
+                    time.sleep(random.uniform(0, min(self.delai_max, self.delai_base * 2 ** essai)))
+                requetes_par_id = dict(en_attente)
+                lots = [en_attente[i:i + self.taille_lot] for i in range(0, len(en_attente), self.taille_lot)]
+                en_attente = []
+                for resultats in pool.map(self._executer_lot, lots):
+                    for request_id, (response, exception) in resultats.items():
+                        if exception is not None and erreur_temporaire(exception) and essai + 1 < self.nb_essais:
+                            en_attente.append((request_id, requetes_par_id[request_id]))
+                            continue
+                        if exception is not None:
+                            nb_echecs += 1
+                        callback(request_id, response, exception)
+                if en_attente:
+                    print(f"[Agenda] {len(en_attente)} requête(s) en échec temporaire, nouvel essai ({essai + 2}/{self.nb_essais})")
+        return nb_echecs
+
+# Champs retournés par l'API après une écriture (seuls l'id et l'etag sont conservés dans l'état local)
+CHAMPS_REPONSE = "id,etag"
+
+def appliquer_plan(service, etat, events_to_create, events_to_update, events_to_delete, calendar_id='primary'):
+    """
+    Applique les opérations planifiées (format de planifier_synchro) par l'exécuteur de lots ;
+    chaque réponse met à jour l'état local. Un événement déjà supprimé (404/410) est simplement oublié.
+    Les opérations sur les événements les plus proches sont envoyées en premier.
+    Une mise à jour dont les champs modifiés sont connus est envoyée en PATCH avec ces seuls champs ;
+    les réponses sont réduites à l'id et à l'etag (fields=).
+    Les créations portent l'id déterministe du csv_id (identifiant_evenement) : si cet id existe déjà (409),
+    création déjà aboutie lors d'un essai précédent ou événement supprimé dont Google garde l'id,
+    l'événement est remplacé par le corps voulu (et rétabli s'il était supprimé).
+    Retourne le nombre d'opérations en échec.
+    """
+    empreintes, creations, existants = {}, {}, []
+    def enregistrer_reponse(request_id, response, exception):
+        if exception is not None:
+            if request_id in creations and isinstance(exception, HttpError) and exception.resp.status == 409:
+                existants.append(request_id)
+            elif request_id not in empreintes and isinstance(exception, HttpError) and exception.resp.status in (404, 410):
+                etat.supprimer(calendar_id, request_id)
+            else:
+                print(f"[Agenda] Échec de la requête {request_id} : {exception}")
+        elif request_id in empreintes:
+            etat.enregistrer(calendar_id, request_id, response, *empreintes[request_id])
         else:
-            events_to_create.append(event_body)
-    existing_csv_ids = set(existing_events.keys())
-    new_csv_ids = set(sanitize_csv_id(f"{row['Date']}_{row['Start Time']}_{row['Subject']}_{row['Location']}") for _, row in df.iterrows())
-    obsolete_ids = existing_csv_ids - new_csv_ids
-    for obsolete_id in obsolete_ids:
-        events_to_delete.append(existing_events[obsolete_id]['id'])
-    print(f"[Agenda] Création : {len(events_to_create)} | Mise à jour : {len(events_to_update)} | Suppression : {len(events_to_delete)}")
-    batch = service.new_batch_http_request()
-    for event in events_to_create:
-        batch.add(service.events().insert(calendarId='primary', body=event))
-    for event in events_to_update:
-        batch.add(service.events().update(calendarId='primary', eventId=event['id'], body=event))
-    for event_id in events_to_delete:
-        batch.add(service.events().delete(calendarId='primary', eventId=event_id))
-    batch.execute()
+            etat.supprimer(calendar_id, request_id)
+
+    # Une seule ressource events : service.events() reconstruit ses méthodes à chaque appel
+    evenements = service.events()
+    requetes = []
+    for csv_id, event, empreinte in events_to_create:
+        empreintes[csv_id] = (empreinte, contenu_canonique(event))
+        creations[csv_id] = dict(event, id=identifiant_evenement(csv_id))
+        requetes.append((csv_id, evenements.insert(calendarId=calendar_id, body=creations[csv_id],
+                                                   fields=CHAMPS_REPONSE)))
+    for csv_id, event_id, event, empreinte, champs in events_to_update:
+        empreintes[csv_id] = (empreinte, contenu_canonique(event))
+        if champs is None:
+            requete = evenements.update(calendarId=calendar_id, eventId=event_id, body=event, fields=CHAMPS_REPONSE)
+        else:
+            corps = {champ: event[champ] for champ in champs}
+            corps["extendedProperties"] = event["extendedProperties"]
+            requete = evenements.patch(calendarId=calendar_id, eventId=event_id, body=corps, fields=CHAMPS_REPONSE)
+        requetes.append((csv_id, requete))
+    for csv_id, event_id in events_to_delete:
+        requetes.append((csv_id, evenements.delete(calendarId=calendar_id, eventId=event_id)))
+    executeur = ExecuteurLots(service, TAILLE_LOT, LOTS_SIMULTANES, NB_ESSAIS, priorite=priorite_csv_id)
+    nb_echecs = executeur.executer(requetes, enregistrer_reponse)
+    if existants:
+        nb_echecs -= len(existants)
+        nb_echecs += executeur.executer(
+            [(csv_id, evenements.update(calendarId=calendar_id, eventId=creations[csv_id]["id"],
+                                        body=dict(creations[csv_id], status="confirmed"), fields=CHAMPS_REPONSE))
+             for csv_id in existants], enregistrer_reponse)
+    return nb_echecs
+
+def partitionner_evenements(prep):
+    """
+    Répartit une seule fois les événements préparés entre les calendriers configurés :
+    "primary" (tous les événements, si calendrier_principal), puis selon CALENDRIERS
+    "feuille:<feuille>" (promotion), "salle:<salle>" et "ue:<code>" (UE du sujet, voir extraire_sujets).
+    Retourne {partition: sous-ensemble de prep}.
+    """
+    partitions = {}
+    if CALENDRIER_PRINCIPAL:
+        partitions["primary"] = prep
+    if "feuille" in CALENDRIERS and "feuille" in prep:
+        for feuille, groupe in prep.groupby("feuille", sort=False):
+            partitions[f"feuille:{feuille}"] = groupe
+    if "salle" in CALENDRIERS:
+        for salle, groupe in prep[prep["location"] != ""].groupby("location", sort=False):
+            partitions[f"salle:{salle}"] = groupe
+    if "ue" in CALENDRIERS:
+        ues = prep["summary"].map(lambda sujet: sorted({ue for _, ue in extraire_sujets(sujet)})).explode().dropna()
+        for ue, index in ues.groupby(ues, sort=True).groups.items():
+            partitions[f"ue:{ue}"] = prep.loc[index]
+    return partitions
+
+def libelle_calendrier(partition):
+    """Libellé des messages d'un calendrier ("" pour le calendrier principal)."""
+    return "" if partition == "primary" else f" {partition}"
+
+def calendriers_existants(service):
+    """Retourne {titre: calendarId} des calendriers de l'utilisateur (calendarList)."""
+    existants, page_token = {}, None
+    while True:
+        LIMITEUR.acquerir()
+        with connexion_service(service) as http:
+            page = service.calendarList().list(pageToken=page_token, fields="items(id,summary),nextPageToken").execute(
+                http=http, num_retries=NB_ESSAIS - 1)
+        for calendrier in page.get("items", []):
+            existants.setdefault(calendrier.get("summary"), calendrier["id"])
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return existants
+
+def titre_calendrier(partition):
+    """Titre d'un calendrier secondaire ("<prefixe> - M1 2324", "<prefixe> - Salle UT2J GS027", "<prefixe> - UE 701")."""
+    genre, _, nom = partition.partition(":")
+    genre_nom = {"feuille": "", "salle": "Salle ", "ue": "UE "}[genre]
+    if nom.lower().startswith(genre_nom.lower()):
+        genre_nom = ""
+    return f"{PREFIXE_CALENDRIERS} - {genre_nom}{nom}"
+
+def resoudre_calendriers(service, etat, partitions, creer=True):
+    """
+    Retourne {partition: calendarId}. Les calendriers secondaires absents de l'état local sont retrouvés
+    par leur titre (titre_calendrier), sinon créés (ou None si creer est faux), et retenus dans l'état local.
+    """
+    calendriers, existants = {}, None
+    for partition in partitions:
+        calendar_id = "primary" if partition == "primary" else etat.calendrier(partition)
+        if calendar_id is None:
+            titre = titre_calendrier(partition)
+            if existants is None:
+                existants = calendriers_existants(service)
+            calendar_id = existants.get(titre)
+            if calendar_id is None and not creer:
+                calendriers[partition] = None
+                continue
+            if calendar_id is None:
+                LIMITEUR.acquerir()
+                with connexion_service(service) as http:
+                    calendar_id = service.calendars().insert(
+                        body={"summary": titre, "timeZone": FUSEAU_AGENDA}, fields="id").execute(
+                        http=http, num_retries=NB_ESSAIS - 1)["id"]
+                print(f"[Agenda] Calendrier créé : {titre}")
+            etat.definir_calendrier(partition, calendar_id)
+        calendriers[partition] = calendar_id
+    return calendriers
+
+def executer_par_calendrier(service, etat, partitions, tache, creer=True):
+    """
+    Exécute tache(calendar_id, *données) pour chaque calendrier {partition: données} en parallèle,
+    un thread par calendrier : la durée totale est celle du calendrier le plus long.
+    Si creer est faux, les calendriers secondaires encore inexistants ne sont pas créés (calendar_id None).
+    Le compte rendu retourné par chaque tâche est affiché une fois tous les calendriers traités, dans l'ordre.
+    Un calendrier secondaire supprimé dans Google (404) est oublié, pour être recréé à la synchronisation suivante.
+    Lève la première erreur rencontrée, une fois tous les calendriers traités.
+    """
+    calendriers = resoudre_calendriers(service, etat, partitions, creer)
+    with ThreadPoolExecutor(max_workers=max(1, len(partitions))) as pool:
+        futures = {partition: pool.submit(tache, calendriers[partition], *donnees)
+                   for partition, donnees in partitions.items()}
+    erreurs = []
+    for partition, future in futures.items():
+        try:
+            compte_rendu = future.result()
+            if compte_rendu:
+                print(f"[Agenda{libelle_calendrier(partition)}] {compte_rendu}")
+        except Exception as e:
+            if partition != "primary" and isinstance(e, HttpError) and e.resp.status == 404:
+                etat.oublier_calendrier(partition)
+            print(f"[Agenda{libelle_calendrier(partition)}] Erreur : {e}")
+            erreurs.append(e)
+    if erreurs:
+        raise erreurs[0]
+
+def planifier_calendrier(service, etat, calendar_id, prep, horizon, time_max, dedoublonner=True):
+    """
+    Réconcilie l'état local d'un calendrier avec ses changements (s'il existe déjà), puis planifie
+    sa synchronisation (planifier_synchro). Seuls les doublons éventuels sont supprimés du calendrier
+    (aucune écriture si dedoublonner est faux).
+    """
+    if calendar_id is not None:
+        reconcilier_agenda(service, etat, calendar_id, time_min=horizon, time_max=time_max, dedoublonner=dedoublonner)
+    return planifier_synchro(prep, etat, calendar_id, horizon)
+
+def synchroniser_calendrier(service, etat, calendar_id, prep, horizon, time_max):
+    """
+    Synchronisation complète d'un calendrier : réconciliation, planification sur l'état local, envoi.
+    Retourne le compte rendu des opérations.
+    """
+    events_to_create, events_to_update, events_to_delete = planifier_calendrier(
+        service, etat, calendar_id, prep, horizon, time_max)
+    nb_echecs = appliquer_plan(service, etat, events_to_create, events_to_update, events_to_delete, calendar_id)
+    compte_rendu = f"Création : {len(events_to_create)} | Mise à jour : {len(events_to_update)} | Suppression : {len(events_to_delete)}"
+    if nb_echecs:
+        compte_rendu += f"\n⚠️ {nb_echecs} opération(s) en échec, reprises à la prochaine synchronisation"
+    return compte_rendu
+
+def sync_events(service, df=None, prep=None):
+    """
+    Synchronise les événements du CSV (df, ou déjà préparés : prep) avec Google Calendar :
+    création, mise à jour et suppression par lots (ExecuteurLots).
+    Les événements sont répartis une seule fois entre les calendriers configurés (partitionner_evenements),
+    synchronisés en parallèle, chacun avec son état local et ses propres lots.
+    Pour chaque calendrier, l'état local (etat_agenda) est d'abord réconcilié avec les changements du calendrier,
+    puis sert seul à planifier les opérations ; les réponses le tiennent à jour.
+    Seuls les événements de l'horizon de synchronisation (du début de l'horizon à la fin de la période
+    extraite) sont listés et synchronisés ; les événements plus anciens sont figés.
+    """
+    etat = etat_agenda()
+    horizon = debut_horizon()
+    partitions, time_max = repartir_evenements(etat, df, prep)
+    executer_par_calendrier(
+        service, etat, {partition: (sous_prep, horizon, time_max) for partition, sous_prep in partitions.items()},
+        lambda calendar_id, *donnees: synchroniser_calendrier(service, etat, calendar_id, *donnees))
+    afficher_quota()
+
+def repartir_evenements(etat, df, prep=None):
+    """
+    Prépare les événements du CSV (sauf s'ils sont déjà préparés : prep) et les répartit entre les calendriers
+    (partitionner_evenements), y compris les calendriers secondaires connus qui n'ont plus d'événements
+    et doivent être vidés.
+    Retourne ({partition: événements préparés}, fin de la période extraite (UTC)).
+    """
+    if prep is None:
+        prep = preparer_evenements(df)
+    partitions = partitionner_evenements(prep)
+    for partition in etat.partitions():
+        if partition.partition(":")[0] in CALENDRIERS and partition not in partitions:
+            partitions[partition] = prep.iloc[:0]
+    return partitions, (prep["fin_utc"].max() if len(prep) else None)
+
+def afficher_quota():
+    usage = LIMITEUR.usage()
+    print(f"[Agenda] Quota : {usage['requetes_jour']} requête(s) aujourd'hui"
+          + (f" / {usage['budget_journalier']}" if usage['budget_journalier'] else ""))
+
+def operations_plan(connus, events_to_create, events_to_update, events_to_delete):
+    """
+    Opérations planifiées (format de planifier_synchro) sous forme enregistrable en JSON, avec pour
+    chaque événement existant l'etag attendu et, pour une mise à jour, les valeurs avant/après
+    des champs modifiés (formes canoniques).
+    """
+    operations = []
+    for csv_id, event, empreinte in events_to_create:
+        operations.append({"operation": "insert", "csv_id": csv_id, "corps": event, "empreinte": empreinte})
+    for csv_id, event_id, event, empreinte, champs in events_to_update:
+        connu = connus[csv_id]
+        avant = json.loads(connu[3]) if connu[3] else {}
+        apres = normaliser_evenement(event)
+        operations.append({
+            "operation": "update" if champs is None else "patch", "csv_id": csv_id, "event_id": event_id,
+            "etag": connu[1], "champs": champs,
+            "differences": {champ: {"avant": avant.get(champ), "apres": valeur}
+                            for champ, valeur in apres.items() if avant.get(champ) != valeur},
+            "corps": event, "empreinte": empreinte})
+    for csv_id, event_id in events_to_delete:
+        connu = connus[csv_id]
+        operations.append({"operation": "delete", "csv_id": csv_id, "event_id": event_id, "etag": connu[1],
+                           "evenement": json.loads(connu[3]) if connu[3] else None})
+    return operations
+
+def estimer_plan(plan):
+    """
+    Coût estimé d'un plan : requêtes d'écriture (une unité de quota chacune, même dans un batch),
+    lots, lectures de réconciliation, durée minimale au débit du limiteur (qps_api) et part du budget journalier restant.
+    """
+    nombres = {"insert": 0, "update": 0, "patch": 0, "delete": 0}
+    lots = 0
+    for calendrier in plan["calendriers"]:
+        for operation in calendrier["operations"]:
+            nombres[operation["operation"]] += 1
+        lots += -(-len(calendrier["operations"]) // TAILLE_LOT)
+    calendriers_crees = sum(calendrier["calendar_id"] is None for calendrier in plan["calendriers"])
+    requetes = sum(nombres.values()) + calendriers_crees + len(plan["calendriers"])
+    usage = LIMITEUR.usage()
+    restant = usage["restant"]
+    return dict(nombres, calendriers_crees=calendriers_crees, lots=lots,
+                lectures=len(plan["calendriers"]), requetes=requetes,
+                duree_minimale_s=round(requetes / usage["qps"], 1) if usage["qps"] else None,
+                part_budget_restant=round(requetes / restant, 4) if restant else None)
+
+def planifier_agenda(service, df):
+    """
+    Planifie la synchronisation des événements du CSV sans rien écrire dans les calendriers : ceux-ci sont
+    seulement lus pour réconcilier l'état local, et les calendriers secondaires manquants ne sont pas créés.
+    Retourne le plan (dictionnaire enregistrable en JSON) : opérations par calendrier (operations_plan)
+    et estimation de leur coût (estimer_plan). Il peut être appliqué plus tard (appliquer_plan_enregistre).
+    """
+    etat = etat_agenda()
+    horizon = debut_horizon()
+    partitions, time_max = repartir_evenements(etat, df)
+    calendriers = {}
+
+    def planifier(calendar_id, partition, prep):
+        events_to_create, events_to_update, events_to_delete = planifier_calendrier(
+            service, etat, calendar_id, prep, horizon, time_max, dedoublonner=False)
+        calendriers[partition] = {
+            "partition": partition, "calendar_id": calendar_id,
+            "titre": None if partition == "primary" else titre_calendrier(partition),
+            "operations": operations_plan(etat.evenements(calendar_id), events_to_create, events_to_update, events_to_delete)}
+        return (f"Prévu - Création : {len(events_to_create)} | Mise à jour : {len(events_to_update)}"
+                f" | Suppression : {len(events_to_delete)}" + (" (calendrier à créer)" if calendar_id is None else ""))
+
+    executer_par_calendrier(service, etat, {partition: (partition, prep) for partition, prep in partitions.items()},
+                            planifier, creer=False)
+    plan = {"version": 1, "cree_le": dt.now().isoformat(timespec="seconds"), "horizon": horizon, "time_max": time_max,
+            "calendriers": [calendriers[partition] for partition in partitions]}
+    plan["estimation"] = estimer_plan(plan)
+    return plan
+
+def appliquer_plan_enregistre(service, plan):
+    """
+    Applique un plan de planifier_agenda. Chaque calendrier est d'abord réconcilié ; une opération n'est envoyée
+    que si l'événement est toujours tel que le plan l'a vu (même event_id et même etag, ou toujours absent
+    pour une création). Les autres opérations sont écartées comme conflits : l'agenda a changé depuis,
+    il faut planifier à nouveau. Retourne le nombre d'opérations écartées.
+    """
+    etat = etat_agenda()
+    conflits = []
+
+    def appliquer(calendar_id, operations):
+        reconcilier_agenda(service, etat, calendar_id, time_min=plan["horizon"], time_max=plan["time_max"])
+        connus = etat.evenements(calendar_id)
+        events_to_create, events_to_update, events_to_delete, ecartees = [], [], [], 0
+        for operation in operations:
+            connu = connus.get(operation["csv_id"])
+            if operation["operation"] == "insert":
+                if connu is None:
+                    events_to_create.append((operation["csv_id"], operation["corps"], operation["empreinte"]))
+                    continue
+            elif connu is not None and (connu[0], connu[1]) == (operation["event_id"], operation["etag"]):
+                if operation["operation"] == "delete":
+                    events_to_delete.append((operation["csv_id"], operation["event_id"]))
+                else:
+                    events_to_update.append((operation["csv_id"], operation["event_id"], operation["corps"],
+                                             operation["empreinte"], operation["champs"]))
+                continue
+            ecartees += 1
+        conflits.append(ecartees)
+        nb_echecs = appliquer_plan(service, etat, events_to_create, events_to_update, events_to_delete, calendar_id)
+        return (f"Création : {len(events_to_create)} | Mise à jour : {len(events_to_update)}"
+                f" | Suppression : {len(events_to_delete)} | Conflits : {ecartees}"
+                + (f" | Échecs : {nb_echecs}" if nb_echecs else ""))
+
+    executer_par_calendrier(service, etat, {calendrier["partition"]: (calendrier["operations"],)
+                                            for calendrier in plan["calendriers"]}, appliquer)
+    afficher_quota()
+    return sum(conflits)
+
+def cellules_affectees(version_base, version_cible, cles):
+    """
+    Traduit les cellules modifiées détectées par la surveillance (clés (feuille, plage))
+    en ensemble de cellules (feuille, ligne, colonne) dont les événements doivent être recalculés :
+    - toutes les cellules de la plage modifiée ;
+    - toute la ligne si la colonne des semaines (dates) est touchée ;
+    - toutes les cellules des anciennes et nouvelles fusions qui recouvrent ces cellules.
+    """
+    cellules = set()
+    for feuille, (min_row, min_col, max_row, max_col) in cles:
+        if min_col == MIN_COL:
+            min_col, max_col = MIN_COL, MAX_COL
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                cellules.add((feuille, row, col))
+    for version in (version_base, version_cible):
+        for feuille, row, col in list(cellules):
+            grille = version.grilles.get(feuille)
+            plage = plage_fusionnee(grille["index_fusions"], row, col) if grille is not None else None
+            if plage is not None:
+                for r in range(plage[0], plage[2] + 1):
+                    for c in range(plage[1], plage[3] + 1):
+                        cellules.add((feuille, r, c))
+    return cellules
+
+def entetes_grille(grille):
+    """Contenu des cellules de la ligne des demi-journées (MIN_ROW - 1) d'une grille, None si la feuille est absente."""
+    if grille is None:
+        return None
+    return [dict(grille["cellules"].get((MIN_ROW - 1, col), {})) for col in range(MIN_COL, MAX_COL + 1)]
+
+def synchroniser_cellules(service, version_base, version_cible, cles):
+    """
+    Synchronisation incrémentale : seuls les événements issus des cellules modifiées entre
+    version_base (déjà synchronisée) et version_cible sont créés, mis à jour ou supprimés,
+    dans chacun des calendriers concernés (en parallèle).
+    Les opérations sont décidées d'après l'état local (etat_agenda) et envoyées par appliquer_plan.
+    Retourne False si la synchronisation incrémentale est impossible (calendrier jamais réconcilié,
+    en-têtes absents ou modifiés) ou incomplète (opérations en échec) : une synchronisation complète
+    est alors nécessaire.
+    """
+    etat = etat_agenda()
+    if set(version_base.feuilles) != set(version_cible.feuilles):
+        return False
+    # La ligne des demi-journées (MIN_ROW - 1) est hors de l'instantané surveillé : une modification
+    # de ces en-têtes touche les événements de toute la colonne, d'où une synchronisation complète
+    for feuille in version_cible.feuilles:
+        if entetes_grille(version_base.grilles.get(feuille)) != entetes_grille(version_cible.grilles.get(feuille)):
+            return False
+    events_base, origines_base, prep_base = evenements_version(version_base)
+    events_cible, origines_cible, prep_cible = evenements_version(version_cible)
+    if events_base is None or events_cible is None:
+        return False
+    cellules = cellules_affectees(version_base, version_cible, cles)
+
+    # Copies : les événements préparés de chaque version sont conservés tels quels (evenements_version)
+    prep_base = prep_base.assign(modifie=np.array([origine in cellules for origine in origines_base], dtype=bool))
+    prep_cible = prep_cible.assign(modifie=np.array([origine in cellules for origine in origines_cible], dtype=bool))
+    parts_base, parts_cible = partitionner_evenements(prep_base), partitionner_evenements(prep_cible)
+    partitions = {partition: (parts_base.get(partition, prep_base.iloc[:0]), parts_cible.get(partition, prep_cible.iloc[:0]))
+                  for partition in {**parts_base, **parts_cible}}
+    for partition in partitions:
+        calendar_id = "primary" if partition == "primary" else etat.calendrier(partition)
+        if calendar_id is None or etat.jeton(calendar_id) is None:
+            return False
+    ecrire_csv_agenda(events_cible)
+    if OUTPUT_ICS:
+        exporter_ics(prep_cible)
+    horizon = debut_horizon()
+    print(f"[Agenda] Synchronisation incrémentale ({len(cellules)} cellule(s))")
+    echecs = []
+    executer_par_calendrier(
+        service, etat, {partition: (base, cible, horizon) for partition, (base, cible) in partitions.items()},
+        lambda calendar_id, *donnees: synchroniser_cellules_calendrier(service, etat, calendar_id, *donnees, echecs))
+    if sum(echecs):
+        print(f"[Agenda] {sum(echecs)} opération(s) en échec : synchronisation complète")
+        return False
+    return True
+
+def synchroniser_cellules_calendrier(service, etat, calendar_id, prep_base, prep_cible, horizon, echecs):
+    """
+    Synchronisation incrémentale d'un calendrier (colonne "modifie" : événement issu d'une cellule modifiée).
+    Le nombre d'opérations en échec est ajouté à la liste echecs.
+    Retourne le compte rendu des opérations, None si le calendrier n'est pas concerné.
+    """
+    anciens = set(prep_base["csv_id"][prep_base["modifie"]])
+    nouveaux = prep_cible[prep_cible["modifie"] & (prep_cible["debut_utc"] >= horizon)]
+    connus = etat.evenements(calendar_id)
+    events_to_create, events_to_update = [], []
+    for evenement in nouveaux.drop_duplicates("csv_id").itertuples(index=False):
+        planifier_evenement(evenement.csv_id, corps_evenement(evenement), connus.get(evenement.csv_id),
+                            events_to_create, events_to_update)
+    csv_ids_obsoletes = anciens.difference(prep_cible["csv_id"])
+    events_to_delete = [(csv_id, connus[csv_id][0]) for csv_id in csv_ids_obsoletes
+                        if csv_id in connus and (connus[csv_id][4] is None or connus[csv_id][4] >= horizon)]
+    if not (events_to_create or events_to_update or events_to_delete):
+        return None
+    nb_echecs = appliquer_plan(service, etat, events_to_create, events_to_update, events_to_delete, calendar_id)
+    echecs.append(nb_echecs)
+    return (f"Création : {len(events_to_create)} | Mise à jour : {len(events_to_update)}"
+            f" | Suppression : {len(events_to_delete)}" + (f" | Échecs : {nb_echecs}" if nb_echecs else ""))
 
 # =============================================================================
 # PARTIE 5 : EXÉCUTION CONJOINTE AVEC THREADING
@@ -574,29 +2844,160 @@ def run_modifications():
 
 def run_agenda():
     """
-    Exécute périodiquement la génération du CSV pour l'agenda et la synchronisation
-    avec Google Calendar (toutes les 5 minutes).
+    Synchronise l'agenda au fil des modifications : les cellules modifiées détectées par la
+    surveillance (FILE_SYNCHRO) déclenchent une synchronisation incrémentale des seuls événements
+    concernés. Une synchronisation complète (génération du CSV et comparaison de tout le calendrier)
+    est faite au démarrage, puis toutes les INTERVALLE_RECONCILIATION secondes par sécurité,
+    ou lorsque la synchronisation incrémentale n'est pas possible.
     """
+    version_traitee = None
+    prochaine_reconciliation = 0.0
     while True:
         try:
-            process_agenda()
+            changements = []
+            try:
+                changements.append(FILE_SYNCHRO.get(timeout=max(prochaine_reconciliation - time.monotonic(), 0)))
+                while True:
+                    changements.append(FILE_SYNCHRO.get_nowait())
+            except queue.Empty:
+                pass
+            if version_traitee is not None:
+                changements = [c for c in changements if c[1].numero > version_traitee.numero]
+                if not changements and time.monotonic() < prochaine_reconciliation:
+                    continue
+            if changements:
+                # Les changements doivent se suivre à partir de la dernière version synchronisée
+                contigus = version_traitee is not None and changements[0][0].numero == version_traitee.numero and all(
+                    precedent[1].numero == suivant[0].numero for precedent, suivant in zip(changements, changements[1:]))
+                version_cible = changements[-1][1]
+                cles = [cle for changement in changements for cle in changement[2]]
+                if contigus:
+                    service = service_agenda()
+                    if synchroniser_cellules(service, version_traitee, version_cible, cles):
+                        version_traitee = version_cible
+                        continue
+            else:
+                version_cible = CHARGEUR.actualiser()
+            process_agenda(version=version_cible)
+            version_traitee = version_cible
+            prochaine_reconciliation = time.monotonic() + INTERVALLE_RECONCILIATION
         except Exception as e:
             print(f"Erreur dans le traitement de l'agenda : {e}")
-        time.sleep(300)
+            # Après une erreur, synchronisation complète après INTERVALLE_MODIF secondes. Les jetons sont conservés :
+            # l'état local et le jeton de chaque calendrier sont enregistrés ensemble (EtatAgenda.reconcilier)
+            # et un jeton expiré (410) est déjà remplacé par un listage complet dans reconcilier_agenda
+            version_traitee = None
+            prochaine_reconciliation = 0.0
+            time.sleep(INTERVALLE_MODIF)
 
 def main():
     """
-    Fonction principale qui démarre les threads de surveillance des modifications Excel
-    et de génération/synchronisation de l'agenda.
+    Fonction principale qui démarre le thread de chargement du classeur (partagé)
+    et les threads de surveillance des modifications Excel et de génération/synchronisation de l'agenda.
     """
+    t0 = threading.Thread(target=CHARGEUR.surveiller, name="ChargeurThread")
     t1 = threading.Thread(target=run_modifications, name="ModifThread")
     t2 = threading.Thread(target=run_agenda, name="AgendaThread")
+    t0.start()
     t1.start()
     t2.start()
+    t0.join()
     t1.join()
     t2.join()
 
+# =============================================================================
+# PARTIE 6 : LIGNE DE COMMANDE
+# =============================================================================
+
+def commande_journal(args):
+    """
+    Consulte la base SQLite du journal :
+    python CNUM_SIGMA2.py journal --cellule H17 --depuis 2025-03-01 --ue 701 [--export extrait.csv]
+    """
+    if not JOURNAL_SQLITE:
+        print("Aucune base de journal configurée (journal_sqlite dans config.txt).")
+        return
+    base = BaseJournal(JOURNAL_SQLITE)
+    if args.importer:
+        print(f"{base.importer_csv(args.importer)} modification(s) importée(s) depuis {args.importer}.")
+        return
+    filtres = {"cellule": args.cellule, "debut": args.depuis, "fin": args.jusqua, "ue": args.ue, "limite": args.limite}
+    if args.export:
+        print(f"{base.exporter_csv(args.export, **filtres)} modification(s) exportée(s) vers {args.export}.")
+        return
+    for modif in base.rechercher(**filtres):
+        print(f"{modif['date']} {modif['heure']}  {modif['cellule']:<12} "
+              f"{modif['ancienne_donnee']!r} -> {modif['nouvelle_donnee']!r}")
+
+def commande_planifier(args):
+    """
+    Planifie la synchronisation sans modifier l'agenda et enregistre le plan :
+    python CNUM_SIGMA2.py planifier plan.json [--feuilles "M1*"] [--details]
+    """
+    grilles = grilles_agenda(args.feuilles)
+    events, _ = evenements_grilles(grilles) if grilles else (None, None)
+    if events is None:
+        print("Aucun événement à planifier.")
+        return
+    plan = planifier_agenda(service_agenda(), dataframe_evenements(events))
+    with open(args.plan, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+    if args.details:
+        for calendrier in plan["calendriers"]:
+            for operation in calendrier["operations"]:
+                differences = ", ".join(f"{champ} : {valeurs['avant']!r} -> {valeurs['apres']!r}"
+                                        for champ, valeurs in operation.get("differences", {}).items())
+                print(f"{libelle_calendrier(calendrier['partition']).strip() or 'primary'}  {operation['operation']:<7}"
+                      f"{operation['csv_id']}" + (f"  ({differences})" if differences else ""))
+    estimation = plan["estimation"]
+    print(f"📋 Plan enregistré dans {args.plan} : {estimation['insert']} création(s), "
+          f"{estimation['update'] + estimation['patch']} mise(s) à jour, {estimation['delete']} suppression(s), "
+          f"{estimation['calendriers_crees']} calendrier(s) à créer")
+    print(f"   Coût estimé : {estimation['requetes']} requête(s) en {estimation['lots']} lot(s)"
+          + (f", {estimation['duree_minimale_s']} s au moins" if estimation["duree_minimale_s"] is not None else "")
+          + (f", {estimation['part_budget_restant']:.1%} du budget journalier restant"
+             if estimation["part_budget_restant"] is not None else ""))
+
+def commande_appliquer(args):
+    """
+    Applique un plan enregistré par la commande planifier :
+    python CNUM_SIGMA2.py appliquer plan.json
+    """
+    with open(args.plan, encoding="utf-8") as f:
+        plan = json.load(f)
+    conflits = appliquer_plan_enregistre(service_agenda(), plan)
+    if conflits:
+        print(f"⚠️ {conflits} opération(s) écartée(s) : l'agenda a changé depuis le plan du {plan['cree_le']}, "
+              "planifier à nouveau")
+
+def analyser_arguments(argv=None):
+    """Analyse la ligne de commande ; sans sous-commande, le script lance la surveillance et la synchronisation."""
+    parser = argparse.ArgumentParser(description="Synchronisation de l'agenda SIGMA")
+    sous_commandes = parser.add_subparsers(dest="commande")
+    journal = sous_commandes.add_parser("journal", help="consulter ou exporter le journal des modifications")
+    journal.add_argument("--cellule", help="cellule (ex. H17 ou 'M1 2324!H17')")
+    journal.add_argument("--depuis", help="date de début incluse (AAAA-MM-JJ)")
+    journal.add_argument("--jusqua", help="date de fin incluse (AAAA-MM-JJ)")
+    journal.add_argument("--ue", help="code d'UE (ex. 701) ou de sujet (ex. 701_12)")
+    journal.add_argument("--limite", type=int, help="nombre maximal de modifications affichées")
+    journal.add_argument("--export", help="exporter le résultat au format CSV du journal")
+    journal.add_argument("--importer", help="importer un journal CSV existant dans la base")
+    journal.set_defaults(fonction=commande_journal)
+    planifier = sous_commandes.add_parser("planifier", help="planifier la synchronisation sans modifier l'agenda")
+    planifier.add_argument("plan", help="fichier JSON où enregistrer le plan")
+    planifier.add_argument("--feuilles", help="feuilles à traiter, liste ou motif (par défaut celles de config.txt)")
+    planifier.add_argument("--details", action="store_true", help="afficher chaque opération et ses différences")
+    planifier.set_defaults(fonction=commande_planifier)
+    appliquer = sous_commandes.add_parser("appliquer", help="appliquer un plan enregistré par planifier")
+    appliquer.add_argument("plan", help="fichier JSON du plan")
+    appliquer.set_defaults(fonction=commande_appliquer)
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    main()
+    arguments = analyser_arguments()
+    if arguments.commande:
+        arguments.fonction(arguments)
+    else:
+        main()
 
 
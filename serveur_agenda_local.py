@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# =============================================================================
+#                   SERVEUR LOCAL GOOGLE CALENDAR (BANC D'ESSAI)
+# =============================================================================
+# =============================================================================
+"""
+Serveur HTTP local remplaçant l'API Google Calendar v3, pour tester et mesurer la synchronisation
+de CNUM_SIGMA2.py sans réseau ni token.json :
+- Document de découverte (build() de googleapiclient peut pointer sur le serveur)
+- events : list (pagination, syncToken, timeMin/timeMax), insert, update, patch, delete, avec etags
+- calendars : insert, calendarList : list (calendriers secondaires)
+- Point d'entrée /batch/calendar/v3 (multipart/mixed)
+- Injection d'erreurs 403/429/5xx et de latence, expiration des jetons de synchronisation
+- Mode banc d'essai (--bench) : synchronisations complète, sans changement, incrémentale et à froid
+  de CNUM_SIGMA2.py sur des milliers d'événements générés
+
+Utilisation :
+    python serveur_agenda_local.py --port 8089 --taux-erreurs 0.05 --latence 0.02
+    puis "api_agenda = http://127.0.0.1:8089/" dans config.txt
+    python serveur_agenda_local.py --bench 10000
+"""
+
+# CHARGEMENT DES BIBLIOTHEQUES
+# ============================
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta, timezone, datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from zoneinfo import ZoneInfo
+
+# =============================================================================
+# PARTIE 1 : ÉTAT DES CALENDRIERS
+# =============================================================================
+
+class ErreurApi(Exception):
+    """Erreur renvoyée au client au format de l'API Google (code HTTP, raison, message)."""
+
+    STATUTS = {400: "INVALID_ARGUMENT", 403: "PERMISSION_DENIED", 404: "NOT_FOUND", 409: "ALREADY_EXISTS",
+               410: "FAILED_PRECONDITION", 429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+    def __init__(self, code, raison, message):
+        super().__init__(message)
+        self.code = code
+        self.raison = raison
+        self.message = message
+
+    def corps(self):
+        return {"error": {"code": self.code, "message": self.message, "status": self.STATUTS.get(self.code, "UNKNOWN"),
+                          "errors": [{"domain": "global", "reason": self.raison, "message": self.message}]}}
+
+# Erreurs injectées : celles de limite de débit (403 rateLimitExceeded, 429) et les erreurs serveur
+ERREURS_INJECTEES = {
+    403: ("rateLimitExceeded", "Rate Limit Exceeded"),
+    429: ("rateLimitExceeded", "Rate Limit Exceeded"),
+    500: ("backendError", "Backend Error"),
+    502: ("badGateway", "Bad Gateway"),
+    503: ("backendError", "Service Unavailable"),
+}
+
+def instant(valeur):
+    """Date RFC 3339 d'un événement ({"dateTime", "timeZone"} ou {"date"}) ou d'un paramètre timeMin/timeMax."""
+    if isinstance(valeur, dict):
+        if "dateTime" not in valeur:
+            return dt.fromisoformat(valeur["date"]).replace(tzinfo=timezone.utc)
+        moment = dt.fromisoformat(valeur["dateTime"])
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=ZoneInfo(valeur.get("timeZone") or "UTC"))
+        return moment
+    moment = dt.fromisoformat(valeur.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def selectionner_champs(objet, champs):
+    """Réduit une réponse au paramètre fields ("id,etag", "items(id,etag),nextSyncToken"...)."""
+    def analyser(texte, position=0):
+        selection, nom = {}, ""
+        while position < len(texte):
+            caractere = texte[position]
+            if caractere == "(":
+                selection[nom.strip()], position = analyser(texte, position + 1)
+                nom = None
+            elif caractere in ",)":
+                if nom:
+                    selection[nom.strip()] = None
+                nom = ""
+                if caractere == ")":
+                    return selection, position
+            elif nom is not None:
+                nom += caractere
+            position += 1
+        if nom:
+            selection[nom.strip()] = None
+        return selection, position
+
+    def appliquer(valeur, selection):
+        if isinstance(valeur, list):
+            return [appliquer(element, selection) for element in valeur]
+        if not isinstance(valeur, dict):
+            return valeur
+        resultat = {}
+        for nom, sous_selection in selection.items():
+            tete, _, reste = nom.partition("/")
+            if tete in valeur:
+                if reste:
+                    sous_selection = {reste: sous_selection}
+                resultat[tete] = valeur[tete] if sous_selection is None else appliquer(valeur[tete], sous_selection)
+        return resultat
+
+    return appliquer(objet, analyser(champs)[0])
+
+def fusionner(cible, modifications):
+    """Fusion récursive d'un PATCH : les objets sont fusionnés, les autres valeurs remplacées."""
+    for cle, valeur in modifications.items():
+        if isinstance(valeur, dict) and isinstance(cible.get(cle), dict):
+            fusionner(cible[cle], valeur)
+        else:
+            cible[cle] = copy.deepcopy(valeur)
+
+# Ids d'événements acceptés par l'API : base32hex en minuscules, de 5 à 1024 caractères
+RE_ID_EVENEMENT = re.compile(r"^[0-9a-v]{5,1024}$")
+
+class AgendaLocal:
+    """
+    État en mémoire des calendriers : événements (les supprimés restent en tombe, status "cancelled"),
+    numéro de séquence global et, par calendrier, séquence de la dernière modification de chaque événement
+    (le jeton de synchronisation est un numéro de séquence).
+    Les jetons plus anciens que historique modifications sont expirés (410), comme le fait Google.
+    """
+
+    def __init__(self, historique=0):
+        self.verrou = threading.Lock()
+        self.historique = historique
+        self.sequence = 0
+        self.calendriers = {}
+        self.creer_calendrier({"id": "primary", "summary": "primary", "timeZone": "Europe/Paris"})
+
+    def creer_calendrier(self, corps):
+        calendrier = dict(corps, kind="calendar#calendar")
+        calendrier.setdefault("id", f"{uuid.uuid4().hex}@group.calendar.local")
+        calendrier["etag"] = f'"{uuid.uuid4().hex}"'
+        self.calendriers[calendrier["id"]] = {"ressource": calendrier, "evenements": {}, "modifications": {}}
+        return calendrier
+
+    def _calendrier(self, calendar_id):
+        if calendar_id not in self.calendriers:
+            raise ErreurApi(404, "notFound", "Not Found")
+        return self.calendriers[calendar_id]
+
+    def _evenement(self, calendrier, event_id, supprime_accepte=False):
+        evenement = calendrier["evenements"].get(event_id)
+        if evenement is None:
+            raise ErreurApi(404, "notFound", "Not Found")
+        if evenement["status"] == "cancelled" and not supprime_accepte:
+            raise ErreurApi(410, "deleted", "Resource has been deleted")
+        return evenement
+
+    def _enregistrer(self, calendrier, evenement):
+        """Nouvelle version d'un événement : séquence, etag, date de mise à jour, horaires avec décalage."""
+        self.sequence += 1
+        evenement["etag"] = f'"{self.sequence}"'
+        evenement["updated"] = dt.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        for cle in ("start", "end"):
+            horaire = evenement.get(cle)
+            if isinstance(horaire, dict) and "dateTime" in horaire:
+                horaire["dateTime"] = instant(horaire).isoformat()
+        # Google omet les champs texte vides
+        for cle in ("summary", "location", "description"):
+            if evenement.get(cle) == "":
+                del evenement[cle]
+        calendrier["evenements"][evenement["id"]] = evenement
+        calendrier["modifications"][evenement["id"]] = self.sequence
+        return copy.deepcopy(evenement)
+
+    def lister(self, calendar_id, parametres):
+        """events.list : une page de résultats (jeton de page "position:séquence du début du listage")."""
+        with self.verrou:
+            calendrier = self._calendrier(calendar_id)
+            sync_token = parametres.get("syncToken")
+            page_token = parametres.get("pageToken")
+            if sync_token and (parametres.get("timeMin") or parametres.get("timeMax")):
+                raise ErreurApi(400, "invalid", "syncToken cannot be combined with timeMin or timeMax")
+            position, instantane = map(int, page_token.split(":")) if page_token else (0, self.sequence)
+            if sync_token:
+                if not sync_token.isdigit():
+                    raise ErreurApi(400, "invalid", "Invalid sync token")
+                depuis = int(sync_token)
+                if self.historique and depuis < self.sequence - self.historique:
+                    raise ErreurApi(410, "fullSyncRequired", "Sync token is no longer valid, a full sync is required.")
+                identifiants = sorted((sequence, event_id) for event_id, sequence in calendrier["modifications"].items()
+                                      if depuis < sequence <= instantane)
+                elements = [calendrier["evenements"][event_id] for _, event_id in identifiants]
+            else:
+                debut_min = instant(parametres["timeMin"]) if parametres.get("timeMin") else None
+                fin_max = instant(parametres["timeMax"]) if parametres.get("timeMax") else None
+                elements = [evenement for evenement in calendrier["evenements"].values()
+                            if (evenement["status"] != "cancelled" or parametres.get("showDeleted") == "true")
+                            and (debut_min is None or instant(evenement["end"]) > debut_min)
+                            and (fin_max is None or instant(evenement["start"]) < fin_max)]
+            taille = min(int(parametres.get("maxResults", 250)), 2500)
+            page = {"kind": "calendar#events", "items": copy.deepcopy(elements[position:position + taille])}
+            if position + taille < len(elements):
+                page["nextPageToken"] = f"{position + taille}:{instantane}"
+            else:
+                page["nextSyncToken"] = str(instantane)
+            return page
+
+    def inserer(self, calendar_id, corps):
+        with self.verrou:
+            calendrier = self._calendrier(calendar_id)
+            evenement = copy.deepcopy(corps)
+            evenement.setdefault("id", uuid.uuid4().hex)
+            if not RE_ID_EVENEMENT.match(evenement["id"]):
+                raise ErreurApi(400, "invalid", "Invalid resource id value.")
+            # Comme Google, l'id d'un événement supprimé reste réservé
+            if evenement["id"] in calendrier["evenements"]:
+                raise ErreurApi(409, "duplicate", "The requested identifier already exists.")
+            evenement.update(kind="calendar#event", status=evenement.get("status", "confirmed"), sequence=0,
+                             created=dt.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+                             iCalUID=f"{evenement['id']}@local")
+            return self._enregistrer(calendrier, evenement)
+
+    def modifier(self, calendar_id, event_id, corps, partiel):
+        """
+        events.update (remplacement) ou events.patch (fusion, partiel). Un événement supprimé
+        peut être rétabli par un remplacement dont le statut est "confirmed".
+        """
+        with self.verrou:
+            calendrier = self._calendrier(calendar_id)
+            ancien = self._evenement(calendrier, event_id, supprime_accepte=not partiel and corps.get("status") == "confirmed")
+            if partiel:
+                evenement = copy.deepcopy(ancien)
+                fusionner(evenement, corps)
+            else:
+                evenement = copy.deepcopy(corps)
+                for cle in ("kind", "status"):
+                    evenement.setdefault(cle, ancien[cle])
+                evenement.setdefault("created", ancien.get("created", ancien.get("updated")))
+                evenement.setdefault("iCalUID", f"{event_id}@local")
+            evenement.update(id=event_id, sequence=ancien.get("sequence", 0) + 1)
+            return self._enregistrer(calendrier, evenement)
+
+    def supprimer(self, calendar_id, event_id):
+        with self.verrou:
+            calendrier = self._calendrier(calendar_id)
+            evenement = self._evenement(calendrier, event_id)
+            self._enregistrer(calendrier, {"kind": "calendar#event", "id": event_id, "status": "cancelled",
+                                           "start": evenement["start"], "end": evenement["end"]})
+
+    def nombre_evenements(self, calendar_id="primary"):
+        with self.verrou:
+            return sum(evenement["status"] != "cancelled"
+                       for evenement in self._calendrier(calendar_id)["evenements"].values())
+
+# =============================================================================
+# PARTIE 2 : SERVEUR HTTP
+# =============================================================================
+
+RE_EVENEMENTS = re.compile(r"^/calendar/v3/calendars/(?P<calendrier>[^/]+)/events(?:/(?P<evenement>[^/]+))?$")
+
+class ServeurAgenda(ThreadingHTTPServer):
+    """
+    Serveur HTTP (un thread par connexion, connexions persistantes) de l'API locale.
+    taux_erreurs : proportion des appels (requête simple, lot, ou requête d'un lot) en échec injecté,
+    avec un code tiré parmi codes_erreur ; latence : délai moyen (s) de chaque requête HTTP ;
+    taille_lot_max : nombre maximal de requêtes par lot (50, comme l'API Calendar).
+    """
+    daemon_threads = True
+
+    def __init__(self, adresse, agenda, taux_erreurs=0.0, codes_erreur=(403, 429, 500, 503), latence=0.0,
+                 taille_lot_max=50, graine=None):
+        super().__init__(adresse, GestionnaireAgenda)
+        self.agenda = agenda
+        self.taux_erreurs = taux_erreurs
+        self.codes_erreur = list(codes_erreur)
+        self.latence = latence
+        self.taille_lot_max = taille_lot_max
+        self.aleatoire = random.Random(graine)
+        self.verrou_compteurs = threading.Lock()
+        self.compteurs = {}
+        self._document_decouverte = None
+
+    def compter(self, nom, nombre=1):
+        with self.verrou_compteurs:
+            self.compteurs[nom] = self.compteurs.get(nom, 0) + nombre
+
+    def releve_compteurs(self):
+        """Retourne les compteurs depuis le dernier relevé et les remet à zéro."""
+        with self.verrou_compteurs:
+            compteurs, self.compteurs = self.compteurs, {}
+        return compteurs
+
+    def injecter_erreur(self):
+        with self.verrou_compteurs:
+            if not self.taux_erreurs or self.aleatoire.random() >= self.taux_erreurs:
+                return
+            code = self.aleatoire.choice(self.codes_erreur)
+        self.compter(f"erreurs_{code}")
+        raison, message = ERREURS_INJECTEES.get(code, ("backendError", "Injected error"))
+        raise ErreurApi(code, raison, message)
+
+    def document_decouverte(self, racine):
+        """Document de découverte de Calendar v3 (celui fourni avec googleapiclient), pointant sur ce serveur."""
+        if self._document_decouverte is None:
+            import googleapiclient
+            chemin = os.path.join(os.path.dirname(googleapiclient.__file__), "discovery_cache", "documents", "calendar.v3.json")
+            with open(chemin, encoding="utf-8") as f:
+                self._document_decouverte = json.load(f)
+        document = dict(self._document_decouverte, rootUrl=racine)
+        document["baseUrl"] = racine + document["servicePath"]
+        return document
+
+    def traiter(self, methode, chemin, parametres, corps):
+        """Exécute un appel de l'API (hors lot) ; retourne (code HTTP, réponse JSON ou None)."""
+        self.injecter_erreur()
+        correspondance = RE_EVENEMENTS.match(chemin)
+        if correspondance:
+            calendar_id = unquote(correspondance["calendrier"])
+            event_id = correspondance["evenement"] and unquote(correspondance["evenement"])
+            if event_id is None and methode == "GET":
+                self.compter("list")
+                return 200, self.agenda.lister(calendar_id, parametres)
+            if event_id is None and methode == "POST":
+                self.compter("insert")
+                return 200, self.agenda.inserer(calendar_id, corps)
+            if event_id is not None and methode in ("PUT", "PATCH"):
+                self.compter("update" if methode == "PUT" else "patch")
+                return 200, self.agenda.modifier(calendar_id, event_id, corps, partiel=methode == "PATCH")
+            if event_id is not None and methode == "DELETE":
+                self.compter("delete")
+                self.agenda.supprimer(calendar_id, event_id)
+                return 204, None
+            if event_id is not None and methode == "GET":
+                with self.agenda.verrou:
+                    calendrier = self.agenda._calendrier(calendar_id)
+                    return 200, copy.deepcopy(self.agenda._evenement(calendrier, event_id))
+        if chemin == "/calendar/v3/users/me/calendarList" and methode == "GET":
+            self.compter("calendarList.list")
+            with self.agenda.verrou:
+                return 200, {"kind": "calendar#calendarList",
+                             "items": [dict(calendrier["ressource"], kind="calendar#calendarListEntry")
+                                       for calendrier in self.agenda.calendriers.values()]}
+        if chemin == "/calendar/v3/calendars" and methode == "POST":
+            self.compter("calendars.insert")
+            with self.agenda.verrou:
+                return 200, self.agenda.creer_calendrier({k: v for k, v in corps.items() if k != "id"})
+        raise ErreurApi(404, "notFound", f"{methode} {chemin} : méthode inconnue du serveur local")
+
+    def repondre(self, methode, chemin, parametres, corps):
+        """traiter() avec les erreurs de l'API converties et la réponse réduite à fields ; retourne (code, octets)."""
+        try:
+            code, reponse = self.traiter(methode, chemin, parametres, corps)
+        except ErreurApi as e:
+            return e.code, json.dumps(e.corps()).encode("utf-8")
+        if reponse is None:
+            return code, b""
+        if parametres.get("fields"):
+            reponse = selectionner_champs(reponse, parametres["fields"])
+        return code, json.dumps(reponse, ensure_ascii=False).encode("utf-8")
+
+    def executer_lot(self, type_contenu, contenu):
+        """Point d'entrée /batch : exécute chaque requête du multipart/mixed ; retourne (type, corps) de la réponse."""
+        limite_requete = re.search(r'boundary="?([^";]+)"?', type_contenu or "")
+        if limite_requete is None:
+            raise ErreurApi(400, "invalid", "Batch requests must be multipart/mixed")
+        parties = []
+        for bloc in contenu.split(b"--" + limite_requete.group(1).encode("ascii"))[1:]:
+            if bloc.startswith(b"--"):
+                break
+            parties.append(separer_entetes(bloc.lstrip(b"\r\n")))
+        if len(parties) > self.taille_lot_max:
+            raise ErreurApi(400, "batchSizeTooLarge", f"A batch can contain at most {self.taille_lot_max} requests")
+        self.injecter_erreur()
+        self.compter("lots")
+        limite = f"batch_{uuid.uuid4().hex}"
+        reponse = []
+        for entetes_partie, requete in parties:
+            ligne, _, reste = requete.partition(b"\n")
+            methode, uri, _ = ligne.decode("ascii").strip().split(" ", 2)
+            corps_requete = separer_entetes(reste)[1]
+            adresse = urlsplit(uri)
+            code, corps = self.repondre(methode, adresse.path, parametres_requete(adresse.query),
+                                        json.loads(corps_requete) if corps_requete.strip() else {})
+            identifiant = entetes_partie.get("content-id", "").strip("<>")
+            reponse.append(f"--{limite}\r\nContent-Type: application/http\r\nContent-ID: <response-{identifiant}>\r\n\r\n"
+                           f"HTTP/1.1 {code} {RAISONS.get(code, '')}\r\nContent-Type: application/json; charset=UTF-8\r\n"
+                           f"Content-Length: {len(corps)}\r\n\r\n".encode("utf-8") + corps + b"\r\n")
+        reponse.append(f"--{limite}--\r\n".encode("ascii"))
+        return f"multipart/mixed; boundary={limite}", b"".join(reponse)
+
+RAISONS = {200: "OK", 204: "No Content", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 409: "Conflict",
+           410: "Gone", 429: "Too Many Requests", 500: "Internal Server Error", 502: "Bad Gateway",
+           503: "Service Unavailable"}
+
+def separer_entetes(message):
+    """Sépare les en-têtes (noms en minuscules) et le corps d'un message HTTP ou d'une partie MIME."""
+    morceaux = re.split(rb"\r?\n\r?\n", message, maxsplit=1)
+    entetes, corps = morceaux if len(morceaux) == 2 else (morceaux[0], b"")
+    resultat = {}
+    # Les en-têtes longs (Content-ID) peuvent être repliés sur plusieurs lignes
+    for ligne in re.sub(r"\r?\n[ \t]+", " ", entetes.decode("utf-8")).splitlines():
+        nom, separateur, valeur = ligne.partition(":")
+        if separateur:
+            resultat[nom.strip().lower()] = valeur.strip()
+    return resultat, corps
+
+def parametres_requete(requete):
+    return {cle: valeurs[-1] for cle, valeurs in parse_qs(requete).items()}
+
+class GestionnaireAgenda(BaseHTTPRequestHandler):
+    """Une connexion HTTP/1.1 (persistante) vers le serveur local."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.compter("connexions")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _envoyer(self, code, corps, type_contenu="application/json; charset=UTF-8"):
+        self.send_response(code)
+        self.send_header("Content-Type", type_contenu)
+        self.send_header("Content-Length", str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def _traiter(self):
+        serveur = self.server
+        serveur.compter("requetes_http")
+        if serveur.latence:
+            time.sleep(serveur.aleatoire.uniform(0.5, 1.5) * serveur.latence)
+        adresse = urlsplit(self.path)
+        longueur = int(self.headers.get("Content-Length") or 0)
+        contenu = self.rfile.read(longueur) if longueur else b""
+        if adresse.path == "/discovery/v1/apis/calendar/v3/rest":
+            document = serveur.document_decouverte(f"http://{self.headers['Host']}/")
+            return self._envoyer(200, json.dumps(document).encode("utf-8"))
+        if adresse.path == "/etat":
+            return self._envoyer(200, json.dumps({"sequence": serveur.agenda.sequence,
+                                                  "compteurs": serveur.compteurs}).encode("utf-8"))
+        if adresse.path in ("/batch", "/batch/calendar/v3") and self.command == "POST":
+            try:
+                type_contenu, corps = serveur.executer_lot(self.headers["Content-Type"], contenu)
+            except ErreurApi as e:
+                return self._envoyer(e.code, json.dumps(e.corps()).encode("utf-8"))
+            return self._envoyer(200, corps, type_contenu)
+        try:
+            corps = json.loads(contenu) if contenu.strip() else {}
+        except ValueError:
+            return self._envoyer(400, json.dumps(ErreurApi(400, "parseError", "Parse Error").corps()).encode("utf-8"))
+        code, reponse = serveur.repondre(self.command, adresse.path, parametres_requete(adresse.query), corps)
+        self._envoyer(code, reponse)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _traiter
+
+def demarrer_serveur(hote="127.0.0.1", port=0, historique=0, **options):
+    """Démarre le serveur dans un thread ; retourne (serveur, URL racine)."""
+    serveur = ServeurAgenda((hote, port), AgendaLocal(historique), **options)
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    return serveur, f"http://{hote}:{serveur.server_address[1]}/"
+
+# =============================================================================
+# PARTIE 3 : BANC D'ESSAI
+# =============================================================================
+
+def evenements_generes(nombre, graine=0):
+    """DataFrame au format du CSV de l'agenda : nombre événements sur des créneaux distincts, à partir de demain."""
+    import pandas as pd
+    aleatoire = random.Random(graine)
+    salles = ["UT2J GS027", "UT2J GS021", "Salle UT2J sans ordi", "1003-Langue", "Salle ENSAT sans ordi"]
+    premier_jour = dt.now().date() + timedelta(days=1)
+    lignes = []
+    for i in range(nombre):
+        jour, creneau = divmod(i, 10)
+        heure = 8 + creneau
+        ue = 701 + aleatoire.randrange(9)
+        lignes.append({"Subject": f"{ue}_{aleatoire.randrange(1, 40)}",
+                       "Date": (premier_jour + timedelta(days=jour)).isoformat(),
+                       "Start Time": f"{heure:02d}:00", "End Time": f"{heure:02d}:50",
+                       "Location": aleatoire.choice(salles), "Description": "",
+                       "Sheet": f"M{1 + i % 2} 2324"})
+    return pd.DataFrame(lignes)
+
+def banc_essai(arguments):
+    """
+    Mesure la synchronisation de CNUM_SIGMA2.py contre le serveur local : synchronisation complète,
+    sans changement, incrémentale (une proportion d'événements modifiés, supprimés et ajoutés)
+    et à froid (état local perdu), avec la durée et les appels reçus par le serveur pour chacune.
+    """
+    serveur, racine = demarrer_serveur(taux_erreurs=arguments.taux_erreurs, codes_erreur=arguments.codes_erreur,
+                                       latence=arguments.latence, historique=arguments.historique,
+                                       graine=arguments.graine)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import CNUM_SIGMA2 as agenda
+    agenda.API_AGENDA = racine
+    agenda.ETAT_AGENDA = os.path.join(tempfile.mkdtemp(), "etat_agenda.sqlite")
+    agenda.LIMITEUR = agenda.LimiteurDebit(arguments.qps_client, 0)
+    if arguments.calendriers is not None:
+        agenda.CALENDRIERS = [genre for genre in arguments.calendriers.split(",") if genre]
+    service = agenda.service_agenda()
+
+    df = evenements_generes(arguments.bench, arguments.graine)
+    nombre = max(1, int(len(df) * arguments.proportion_modifiee))
+    aleatoire = random.Random(arguments.graine)
+    modifie = df.copy()
+    indices = aleatoire.sample(list(modifie.index), 2 * nombre)
+    modifie.loc[indices[:nombre], "Description"] = "Modifié"
+    modifie = modifie.drop(index=indices[nombre:])
+    ajouts = evenements_generes(nombre, arguments.graine + 1)
+    ajouts["Start Time"], ajouts["End Time"] = "07:00", "07:50"
+    modifie = agenda.pd.concat([modifie, ajouts], ignore_index=True)
+
+    def etape(nom, donnees):
+        serveur.releve_compteurs()
+        debut = time.perf_counter()
+        agenda.sync_events(service, donnees)
+        duree = time.perf_counter() - debut
+        compteurs = serveur.releve_compteurs()
+        resultats.append((nom, duree, compteurs))
+
+    resultats = []
+    etape("complète", df)
+    etape("sans changement", df)
+    etape("incrémentale", modifie)
+    agenda._etat_agenda = None
+    agenda.ETAT_AGENDA = os.path.join(tempfile.mkdtemp(), "etat_agenda.sqlite")
+    etape("à froid", modifie)
+    serveur.shutdown()
+
+    print(f"\n📊 Banc d'essai : {len(df)} événements, {nombre} modifiés, supprimés et ajoutés "
+          f"(erreurs injectées : {arguments.taux_erreurs:.0%}, latence : {arguments.latence * 1000:.0f} ms)")
+    for nom, duree, compteurs in resultats:
+        operations = " ".join(f"{cle}={valeur}" for cle, valeur in sorted(compteurs.items()) if cle != "requetes_http")
+        print(f"  {nom:<16} {duree:8.2f} s  {compteurs.get('requetes_http', 0):6d} requête(s) HTTP  {operations}")
+    attendu, obtenu = len(modifie), serveur.agenda.nombre_evenements()
+    print(f"  Calendrier principal : {obtenu} événement(s), {attendu} attendu(s)" + (" ✅" if obtenu == attendu else " ❌"))
+
+def analyser_arguments():
+    parser = argparse.ArgumentParser(description="Serveur local remplaçant l'API Google Calendar v3")
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--taux-erreurs", type=float, default=0.0,
+                        help="proportion des appels en échec injecté (0 à 1)")
+    parser.add_argument("--codes-erreur", type=lambda texte: [int(code) for code in texte.split(",")],
+                        default=[403, 429, 500, 503], help="codes des erreurs injectées (ex. 403,429,503)")
+    parser.add_argument("--latence", type=float, default=0.0, help="délai moyen de chaque requête HTTP (s)")
+    parser.add_argument("--historique", type=int, default=0,
+                        help="modifications retenues pour les jetons de synchronisation (0 : sans limite)")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--bench", type=int, metavar="N", help="banc d'essai de CNUM_SIGMA2.py sur N événements")
+    parser.add_argument("--proportion-modifiee", type=float, default=0.01,
+                        help="banc d'essai : proportion des événements modifiés, supprimés et ajoutés")
+    parser.add_argument("--qps-client", type=float, default=0.0,
+                        help="banc d'essai : débit du limiteur de CNUM_SIGMA2.py (0 : sans limite)")
+    parser.add_argument("--calendriers", help="banc d'essai : calendriers secondaires (ex. salle,ue)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = analyser_arguments()
+    if arguments.bench:
+        banc_essai(arguments)
+    else:
+        serveur = ServeurAgenda((arguments.hote, arguments.port), AgendaLocal(arguments.historique),
+                                taux_erreurs=arguments.taux_erreurs, codes_erreur=arguments.codes_erreur,
+                                latence=arguments.latence, graine=arguments.graine)
+        print(f"📅 API Google Calendar locale : http://{arguments.hote}:{arguments.port}/")
+        try:
+            serveur.serve_forever()
+        except KeyboardInterrupt:
+            pass